@@ -1,13 +1,24 @@
 import pandas as pd
-import sys
-import io
 import re
 import json
+import time
+import asyncio
+from utils.doc_index import DocumentIndex, CONTEXT_CHARS
+from utils.analysis_cache import AnalysisCache
+from utils.exec_engine import ExecEngine, ExecTimeout
+from utils.profiler import DatasetProfile
+from utils.prompt_budget import PROMPT_TOKEN_BUDGET, fit_schema, log_prompt
 
 class AnalystAgent:
-    def __init__(self, model_caller, vault_agent):
+    def __init__(self, model_caller, vault_agent, cache: AnalysisCache = None, engine: ExecEngine = None, token_budget=None,
+                 stream_model=None):
         self.call_model = model_caller
+        self.stream_model = stream_model
         self.vault = vault_agent
+        self.cache = cache
+        self.engine = engine or ExecEngine()
+        # () -> tokens available for the prompts we build (e.g. ModelRotator.prompt_budget)
+        self.token_budget = token_budget or (lambda: PROMPT_TOKEN_BUDGET)
 
     def _extract_code(self, text: str):
         match = re.search(r"```python\s*(.*?)```", text, re.DOTALL)
@@ -17,97 +28,148 @@ class AnalystAgent:
         if "df" in text and ("=" in text or "print" in text): return text.strip()
         return None
 
-    def analyze_data(self, data_packet, data_type: str, english_query: str, session_id: str):
-        safe_query, _ = self.vault.protect(english_query, session_id=session_id)
+    def _structured_prompt(self, profile: DatasetProfile, safe_query: str):
+        # Precomputed at upload: no df.info() / head() on the request path.
+        # Wide frames keep only the columns relevant to the query.
+        schema_info, head_view = fit_schema(profile, safe_query, self.token_budget())
+
+        # 🟢 UPDATED PROMPT: BANS MATPLOTLIB, FORCES JSON CHART
+        prompt = f"""
+        Role: Python Data Analyst.
+        Task: Answer query "{safe_query}" using `df`.
+        
+        SCHEMA:
+        {schema_info}
+        
+        SAMPLE:
+        {head_view}
+        
+        RULES:
+        1. **NO MATPLOTLIB / NO PLOTTING LIBRARIES**: The server cannot display images. Do not import matplotlib or seaborn.
+        2. **CHARTS**: If visual data is asked:
+           - You MUST construct a dictionary named `chart_data`.
+           - Format: `chart_data = {{ "title": "Chart Title", "type": "bar", "data": [{{"label": "Item A", "value": 10}}, {{"label": "Item B", "value": 20}}] }}`
+           - Keep the number of bars under 10 (aggregate if needed).
+        3. **TEXT OUTPUT**: Write a human-readable answer in the `result` variable.
+           - Example: `result = "I found 5 rows matching France..."`
+           - If you do not assign `result`, the user will see nothing.
+        
+        RETURN ONLY PYTHON CODE.
+        """
+        return prompt
+
+    def _report(self, stats: dict, level: str):
+        if stats is not None: stats["cache"] = level
+
+    async def _finish(self, result: str, chart_data, session_id: str):
+        # Restore privacy tokens (off the event loop: may look tokens up in Mongo)
+        final_text = await self.vault.restore_async(result, session_id=session_id)
+        
+        # Restore privacy tokens inside the chart data too
+        if chart_data:
+            try:
+                chart_data = await self.vault.restore_data_async(chart_data, session_id=session_id)
+            except: pass
+
+        return final_text, chart_data
+
+    async def _document_prompt(self, text: str, safe_query: str, doc_index: DocumentIndex = None):
+        # Only the chunks relevant to the query (BM25), not the first 20k chars
+        if doc_index is None and len(text) > CONTEXT_CHARS:
+            doc_index = await asyncio.to_thread(DocumentIndex, text)   # sessions from before indexing
+        excerpts = doc_index.context(text, safe_query) if doc_index else text
+        return f"Find: {safe_query}\n\nDoc:\n{excerpts}"
+
+    async def stream_document(self, text: str, english_query: str, session_id: str, use_cache: bool = True,
+                              doc_index: DocumentIndex = None):
+        """Streaming answer for unstructured sessions: yields restored text chunks as the model writes them."""
+        safe_query, _ = await self.vault.protect_async(english_query, session_id=session_id)
+        prompt = await self._document_prompt(text, safe_query, doc_index)
+        restorer = self.vault.restore_stream(session_id)
+        started = time.monotonic()
+        async for chunk in self.stream_model(prompt, use_cache=use_cache):
+            out = await asyncio.to_thread(restorer.feed, chunk)
+            if out: yield out
+        tail = await asyncio.to_thread(restorer.flush)
+        if tail: yield tail
+        log_prompt("analyst.document", prompt, started)
+
+    async def analyze_data(self, data_packet, data_type: str, english_query: str, session_id: str, use_cache: bool = True,
+                           doc_index: DocumentIndex = None, data_version: str = None,
+                           profile: DatasetProfile = None, stats: dict = None):
+        """
+        Returns (answer, chart_data). `data_version` enables the analysis cache for
+        structured sessions; `stats["cache"]` reports "result", "code" or "miss".
+        """
+        safe_query, _ = await self.vault.protect_async(english_query, session_id=session_id)
 
         if data_type == "structured":
             df = data_packet
-            buffer = io.StringIO()
-            df.info(buf=buffer)
-            schema_info = buffer.getvalue()
-            head_view = df.head(3).to_string()
-
-            # 🟢 UPDATED PROMPT: BANS MATPLOTLIB, FORCES JSON CHART
-            prompt = f"""
-            Role: Python Data Analyst.
-            Task: Answer query "{safe_query}" using `df`.
-            
-            SCHEMA:
-            {schema_info}
-            
-            SAMPLE:
-            {head_view}
-            
-            RULES:
-            1. **NO MATPLOTLIB / NO PLOTTING LIBRARIES**: The server cannot display images. Do not import matplotlib or seaborn.
-            2. **CHARTS**: If visual data is asked:
-               - You MUST construct a dictionary named `chart_data`.
-               - Format: `chart_data = {{ "title": "Chart Title", "type": "bar", "data": [{{"label": "Item A", "value": 10}}, {{"label": "Item B", "value": 20}}] }}`
-               - Keep the number of bars under 10 (aggregate if needed).
-            3. **TEXT OUTPUT**: Write a human-readable answer in the `result` variable.
-               - Example: `result = "I found 5 rows matching France..."`
-               - If you do not assign `result`, the user will see nothing.
-            
-            RETURN ONLY PYTHON CODE.
-            """
-            
+
+            # Level 2: same question on the same data version -> no LLM call, no exec
+            key = self.cache.make_key(data_version, safe_query) if (self.cache and data_version and use_cache) else None
+            cached = self.cache.get_result(key) if key else None
+            if cached is not None:
+                self._report(stats, "result")
+                return await self._finish(*cached, session_id)
+
             try:
-                response_text = self.call_model(prompt)
-                clean_code = self._extract_code(response_text)
+                # Level 1: reuse the generated code, skip only the LLM call
+                clean_code = self.cache.get_code(key) if key else None
+                if clean_code:
+                    self._report(stats, "code")
+                else:
+                    self._report(stats, "miss")
+                    if profile is None:
+                        profile = await asyncio.to_thread(DatasetProfile.build, df)   # sessions from before profiling
+                    prompt = self._structured_prompt(profile, safe_query)
+                    started = time.monotonic()
+                    response_text = await self.call_model(prompt, hedge=True, use_cache=use_cache)
+                    log_prompt("analyst.code", prompt, started)
+                    clean_code = self._extract_code(response_text)
 
                 if not clean_code: return f"Error: No code generated.", None
                 
-                # 🟢 Pre-define chart_data as None so the AI can populate it
-                local_env = {'df': df, 'pd': pd, 'result': None, 'chart_data': None}
-                
-                # Capture standard output just in case
-                old_stdout = sys.stdout
-                redirected_output = io.StringIO()
-                sys.stdout = redirected_output
-                
+                # 🟢 Runs in an isolated worker process (timeout, memory cap, own stdout)
+                frame_key = f"{session_id}-{data_version}" if data_version else None
                 try:
-                    exec(clean_code, {}, local_env)
-                except Exception as e:
-                    sys.stdout = old_stdout
+                    outcome = await self.engine.run(clean_code, df, frame_key)
+                except ExecTimeout as e:
+                    return f"⚠️ {e}. Try a narrower question or aggregate the data first.", None
+
+                if not outcome["ok"]:
                     # Fallback: simple print if code fails
-                    if "matplotlib" in str(e):
+                    if "matplotlib" in outcome["error"]:
                         return "⚠️ Error: The AI tried to use Matplotlib. Please ask it to 'summarize data' instead of plotting.", None
-                    return f"Error executing code: {str(e)}", None
+                    return f"Error executing code: {outcome['error']}", None
 
-                sys.stdout = old_stdout
-                
                 # Retrieve variables
-                result = local_env.get('result')
-                chart_data = local_env.get('chart_data')
+                result = outcome["result"]
+                chart_data = outcome["chart_data"]
                 
                 # Fallback if 'result' variable was ignored by AI
                 if result is None: 
-                    result = redirected_output.getvalue()
+                    result = outcome["stdout"]
 
                 # Safety: Ensure result is a string
                 if not result or not str(result).strip():
                      result = "✅ Analysis complete. (See chart below)" if chart_data else "✅ Done."
 
-                # Restore privacy tokens
-                final_text = self.vault.restore(str(result), session_id=session_id)
-                
-                # Restore privacy tokens inside the chart data too
-                if chart_data:
-                    try:
-                        c_str = json.dumps(chart_data)
-                        c_res = self.vault.restore(c_str, session_id=session_id)
-                        chart_data = json.loads(c_res)
-                    except: pass
+                # Only code that ran cleanly is cached; results stay tokenized
+                if key:
+                    self.cache.set_code(key, clean_code)
+                    self.cache.set_result(key, str(result), chart_data)
 
-                return final_text, chart_data
+                return await self._finish(str(result), chart_data, session_id)
 
             except Exception as e:
                 return f"System Error: {str(e)}", None
 
         elif data_type == "unstructured":
-            # (Unchanged logic for text files)
-            prompt = f"Find: {safe_query}\n\nDoc:\n{data_packet[:20000]}"
-            response_text = self.call_model(prompt)
-            return self.vault.restore(response_text, session_id=session_id), None
+            prompt = await self._document_prompt(data_packet, safe_query, doc_index)
+            started = time.monotonic()
+            response_text = await self.call_model(prompt, use_cache=use_cache)
+            log_prompt("analyst.document", prompt, started)
+            return await self.vault.restore_async(response_text, session_id=session_id), None
 
         return "Unsupported format.", None
\ No newline at end of file
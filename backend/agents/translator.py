@@ -1,11 +1,142 @@
 import json
 import re
+import time
+import asyncio
+
+from utils.prompt_budget import TRANSLATE_CHUNK_TOKENS, split_for_budget, log_prompt
+
+# =========================================================
+# 🟢 OFFLINE LANGUAGE DETECTION (fast path, no LLM round-trip)
+# =========================================================
+# Unicode script blocks -> language. Scripts shared by several languages
+# (Devanagari, Arabic, Cyrillic) get a lower confidence than unique ones.
+SCRIPT_RANGES = [
+    ((0x0900, 0x097F), "Hindi", 0.8),       # Devanagari (also Marathi/Nepali)
+    ((0x0980, 0x09FF), "Bengali", 0.95),
+    ((0x0A00, 0x0A7F), "Punjabi", 0.95),    # Gurmukhi
+    ((0x0A80, 0x0AFF), "Gujarati", 0.95),
+    ((0x0B80, 0x0BFF), "Tamil", 0.95),
+    ((0x0C00, 0x0C7F), "Telugu", 0.95),
+    ((0x0C80, 0x0CFF), "Kannada", 0.95),
+    ((0x0D00, 0x0D7F), "Malayalam", 0.95),
+    ((0x0E00, 0x0E7F), "Thai", 0.95),
+    ((0x0600, 0x06FF), "Arabic", 0.7),      # also Urdu/Persian
+    ((0x0590, 0x05FF), "Hebrew", 0.95),
+    ((0x0370, 0x03FF), "Greek", 0.95),
+    ((0x0400, 0x04FF), "Russian", 0.6),     # Cyrillic
+    ((0xAC00, 0xD7AF), "Korean", 0.95),     # Hangul
+    ((0x3040, 0x30FF), "Japanese", 0.95),   # Hiragana + Katakana
+    ((0x4E00, 0x9FFF), "Chinese", 0.85),    # Han (Japanese if kana present)
+]
+
+# Function words + the verbs people actually use to query data
+ENGLISH_WORDS = set("""
+a about above after all also am an and any are as at be been before being below between both but by can could
+did do does doing down during each few for from further had has have having he her here hers him his how i if in
+into is it its itself just me more most my no nor not now of off on once only or other our out over own same she
+should so some such than that the their them then there these they this those through to too under until up very
+was we were what when where which while who whom why will with would you your
+show list give find get tell count total sum average mean median max min maximum minimum top bottom highest lowest
+many much number per each by group compare trend breakdown distribution rows columns records data table chart
+plot graph percent percentage between over last first month year week day sales revenue customers customer
+""".split())
+
+# Common function words of languages that share the Latin script
+OTHER_LATIN_WORDS = {
+    "Spanish": set("el la los las de del que y en un una es por para con cuántos cuál cuales muestra dame cómo".split()),
+    "French": set("le la les des du de et est en un une pour avec dans que qui combien quel quels montre".split()),
+    "German": set("der die das und ist ein eine nicht mit für den dem von zu wie viele welche zeige".split()),
+    "Portuguese": set("o os as de do da dos das que e em um uma para com não quantos qual mostre".split()),
+    "Italian": set("il lo gli le di del della che e è un una per con non quanti quale mostra".split()),
+    "Dutch": set("de het een van dat die niet op te met voor zijn hoeveel welke toon laat geef wat naar bij".split()),
+    "Hinglish": set("hai hain kya kitne kitna kitni ka ki ke mein nahi aur kaun kaise batao dikhao sabse wala wale ko bhi yeh woh tha".split()),
+}
+
+ENGLISH_CONFIDENCE = 0.85
+# English fast path also needs this share of known English words, and no
+# other-language function words at all (mixed "Toon de top 10 customers per regio")
+ENGLISH_MIN_WORD_SHARE = 0.4
+MIXED_CONFIDENCE_CAP = 0.6
+# Skipping translation because the answer is already in the target language
+TARGET_LANGUAGE_CONFIDENCE = 0.75
+WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+TOKEN_RE = re.compile(r"<\w{0,4}_\d+>")   # vault tokens are not language
+
+
+def _script_language(ch: str):
+    cp = ord(ch)
+    for (lo, hi), lang, conf in SCRIPT_RANGES:
+        if lo <= cp <= hi:
+            return lang, conf
+    return None
+
+
+def detect_language(text: str):
+    """
+    Cheap offline detector. Returns (language, confidence in 0..1).
+    Non-Latin scripts are identified by Unicode block; Latin text is scored
+    against English vs other-language function words. Callers should only
+    trust high-confidence answers and fall back to the LLM otherwise.
+    """
+    text = TOKEN_RE.sub(" ", text or "")
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return "Unknown", 0.0
+
+    # 1. Script vote
+    votes = {}
+    for ch in letters:
+        hit = _script_language(ch)
+        if hit: votes[hit] = votes.get(hit, 0) + 1
+    if votes:
+        (lang, conf), count = max(votes.items(), key=lambda kv: kv[1])
+        share = count / len(letters)
+        if lang == "Chinese" and any(l == "Japanese" for l, _ in votes):
+            lang = "Japanese"
+        if share >= 0.3:
+            return lang, round(conf * min(1.0, share + 0.3), 2)
+
+    # 2. Latin script: accented letters are a strong non-English signal
+    non_ascii = sum(1 for ch in letters if ord(ch) > 127)
+    words = [w.lower() for w in WORD_RE.findall(text)]
+    if not words:
+        return "Unknown", 0.0
+
+    en_hits = sum(1 for w in words if w in ENGLISH_WORDS)
+    # Words that are also English ("as", "in") say nothing about the other language
+    other_hits = {lang: sum(1 for w in words if w in vocab and w not in ENGLISH_WORDS) for lang, vocab in OTHER_LATIN_WORDS.items()}
+    best_other, best_other_hits = max(other_hits.items(), key=lambda kv: kv[1])
+
+    if best_other_hits > en_hits:
+        return best_other, round(min(0.9, best_other_hits / len(words) + 0.3), 2)
+
+    en_ratio = en_hits / len(words)
+    confidence = min(1.0, 0.5 + en_ratio) - 0.15 * best_other_hits - (0.5 * non_ascii / len(letters))
+    # One or two words ("revenue?") carry too little signal to skip the LLM
+    if len(words) < 3:
+        confidence = min(confidence, 0.8)
+    # Foreign function words, or too few English ones: likely mixed, let the LLM decide
+    if best_other_hits or en_ratio < ENGLISH_MIN_WORD_SHARE:
+        confidence = min(confidence, MIXED_CONFIDENCE_CAP)
+    return "English", round(max(0.0, confidence), 2)
+
+
+def is_english_name(language: str):
+    lang = (language or "").strip().lower()
+    return lang in ["english", "en", "unknown", ""] or lang.startswith("en-") or lang.startswith("english")
+
 
 class TranslatorAgent:
-    def __init__(self, model_caller):
+    def __init__(self, model_caller, stream_model=None):
         self.call_model = model_caller
+        self.stream_model = stream_model
+
+    async def detect_and_translate(self, user_text: str, use_cache: bool = True):
+        # ⚡ FAST PATH: confidently English -> no model call at all
+        lang, confidence = detect_language(user_text)
+        if lang == "English" and confidence >= ENGLISH_CONFIDENCE:
+            return {"detected_language": "English", "english_query": user_text}
 
-    def detect_and_translate(self, user_text: str):
         prompt = f"""
         Role: Translator.
         Input: "{user_text}"
@@ -16,7 +147,9 @@ class TranslatorAgent:
         """
         try:
             # We pass json_mode=True, but main.py will ignore it if the model is Gemma
-            response_text = self.call_model(prompt, json_mode=True)
+            started = time.monotonic()
+            response_text = await self.call_model(prompt, json_mode=True, hedge=True, use_cache=use_cache)
+            log_prompt("translator.detect", prompt, started)
             
             if "Error" in response_text: 
                 return {"detected_language": "English", "english_query": user_text}
@@ -27,18 +160,62 @@ class TranslatorAgent:
         except:
             return {"detected_language": "English", "english_query": user_text}
 
-    def translate_response(self, english_response: str, target_language: str, mode: str = "mixed"):
-        if target_language.lower() in ["english", "en", "unknown"]:
+    def needs_translation(self, english_response: str, target_language: str):
+        if is_english_name(target_language):
+            return False
+
+        # ⚡ FAST PATH: the text is already in the target language
+        lang, confidence = detect_language(english_response)
+        return not (lang.lower() == target_language.strip().lower() and confidence >= TARGET_LANGUAGE_CONFIDENCE)
+
+    @staticmethod
+    def _instructions(mode: str):
+        return "Translate EXPLANATIONS to target language. KEEP DATA IN ENGLISH." if mode == "mixed" else "FULLY TRANSLATE everything."
+
+    async def translate_response(self, english_response: str, target_language: str, mode: str = "mixed", use_cache: bool = True):
+        if not self.needs_translation(english_response, target_language):
             return english_response
 
-        instructions = "Translate EXPLANATIONS to target language. KEEP DATA IN ENGLISH." if mode == "mixed" else "FULLY TRANSLATE everything."
-        
-        prompt = f"""
+        instructions = self._instructions(mode)
+
+        # Long answers go out as several smaller prompts, translated concurrently
+        pieces = split_for_budget(english_response, TRANSLATE_CHUNK_TOKENS)
+        started = time.monotonic()
+        translated = await asyncio.gather(*(self._translate_piece(p, instructions, target_language, use_cache) for p in pieces))
+        print(f"📏 [PROMPT] translator.response: {len(pieces)} piece(s), {len(english_response):,} chars in {time.monotonic() - started:.2f}s")
+        return translated[0] if len(translated) == 1 else "\n\n".join(t.strip() for t in translated)
+
+    async def translate_response_stream(self, english_response: str, target_language: str, mode: str = "mixed", use_cache: bool = True):
+        """Streaming translate_response: yields translated text as it arrives, piece by piece."""
+        if not self.needs_translation(english_response, target_language):
+            yield english_response
+            return
+
+        pieces = split_for_budget(english_response, TRANSLATE_CHUNK_TOKENS)
+        started = time.monotonic()
+        for i, piece in enumerate(pieces):
+            if i: yield "\n\n"
+            prompt = self._piece_prompt(piece, self._instructions(mode), target_language)
+            streamed = False
+            try:
+                async for chunk in self.stream_model(prompt, use_cache=use_cache):
+                    streamed = True
+                    yield chunk
+            except Exception:
+                if streamed: raise   # half-translated piece: surface it rather than end silently
+                yield piece
+        print(f"📏 [PROMPT] translator.response (stream): {len(pieces)} piece(s), {len(english_response):,} chars in {time.monotonic() - started:.2f}s")
+
+    @staticmethod
+    def _piece_prompt(text: str, instructions: str, target_language: str):
+        return f"""
         Task: {instructions} -> {target_language}
         Text:
-        {english_response}
+        {text}
         """
+
+    async def _translate_piece(self, text: str, instructions: str, target_language: str, use_cache: bool):
         try:
-            return self.call_model(prompt)
+            return await self.call_model(self._piece_prompt(text, instructions, target_language), use_cache=use_cache)
         except:
-            return english_response
\ No newline at end of file
+            return text
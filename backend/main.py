@@ -3,14 +3,15 @@ import uvicorn
 import uuid
 import certifi
 import sys
+import asyncio
 import pandas as pd
 import json
-import time
 from datetime import datetime
 from typing import Optional, Dict
 from pathlib import Path
 
-from fastapi import FastAPI, Header, UploadFile, File
+from fastapi import FastAPI, Header, UploadFile, File, Response, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from pymongo import MongoClient
@@ -19,11 +20,27 @@ from google import genai
 from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, InternalServerError
 
 # Imports
-from utils.loaders import load_file_universally
+from utils.loaders import (
+    load_file_universally, spool_upload, is_chunkable, iter_structured_chunks,
+    COMPACT_DEFAULT, compact_dataframe, column_bytes, memory_report, iter_measured,
+    shutdown_pdf_pool,
+)
 from utils.file_store import MongoFileStore
+from utils.model_rotator import ModelRotator
+from utils.llm_cache import PromptCache
+from utils.session_cache import SessionCache
+from utils.doc_index import DocumentIndex
+from utils.profiler import DatasetProfile
+from utils.analysis_cache import AnalysisCache
+from utils.exec_engine import ExecEngine
+from utils.pipeline import StagePipeline
+from utils.write_behind import HistoryWriter
+from utils.db_indexes import ensure_indexes
+from utils.lifecycle import LifecycleSweeper
+from utils.pagination import encode_cursor, decode_cursor, keyset_filter
 from agents.vault import VaultAgent
 from agents.analyst import AnalystAgent
-from agents.translator import TranslatorAgent
+from agents.translator import TranslatorAgent, is_english_name
 
 # 1. SETUP
 env_path = Path(__file__).parent / ".env"
@@ -52,205 +69,437 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # =========================================================
 # 🟢 MEGA MODEL ROTATOR (Using ALL your available models)
 # =========================================================
-def generate_content_robust(prompt: str, json_mode: bool = False):
+prompt_cache = PromptCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+    db_path=os.getenv("LLM_CACHE_PATH"),  # e.g. ./llm_cache.sqlite to survive restarts
+)
+model_rotator = ModelRotator(genai_client, cache=prompt_cache)
+
+async def generate_content_robust(prompt: str, json_mode: bool = False, hedge: bool = False, use_cache: bool = True):
     """
     Cycles through 20+ models to guarantee uptime.
+    Awaitable: runs on the SDK's async client so the event loop stays free.
+    `hedge=True` opts the call into speculative requests (when LLM_HEDGING is on).
+    `use_cache=False` bypasses the prompt cache for this call.
     """
-    # Priority Queue based on Speed > Intelligence > Experimental
-    models_to_try = [
-        'gemini-2.0-flash',             
-        'gemini-2.5-flash',             
-        'gemini-1.5-flash',
-        'gemini-flash-latest',
-        'gemini-2.0-flash-lite-preview-02-05', # Very fast backup
-        
-        # Smart Models (Slower, stricter quota)
-        'gemini-1.5-pro',
-        'gemini-pro-latest',
-        
-        # Experimental / New
-        'gemini-2.0-flash-exp',
-        'gemini-exp-1206',
-        'gemini-2.0-flash-001',
-        
-        # Open Models (Note: These DO NOT support JSON mode config)
-        'gemma-3-27b-it',
-        'gemma-3-4b-it' 
-    ]
-    
-    last_err = None
-    
-    for m in models_to_try:
-        try:
-            # 🔴 CRITICAL FIX: Gemma models do not support response_mime_type
-            # We must disable JSON mode enforcement for them, even if requested.
-            current_config = None
-            if json_mode and "gemma" not in m:
-                current_config = {'response_mime_type': 'application/json'}
-
-            # print(f"Trying model: {m}")
-            response = genai_client.models.generate_content(
-                model=m, 
-                contents=prompt, 
-                config=current_config
-            )
-            return response.text
-            
-        except Exception as e:
-            err_str = str(e)
-            
-            # Filter for API errors (Quota, Not Found, Overloaded)
-            # 400 is included now to catch the Gemma error if it slips through
-            if any(x in err_str for x in ["429", "404", "RESOURCE", "NOT_FOUND", "Quota", "busy", "exhausted", "400", "INVALID_ARGUMENT"]):
-                last_err = e
-                # 🔴 FIX: If quota is hit, wait a split second before hitting the next model
-                if "429" in err_str or "Quota" in err_str:
-                    time.sleep(1) 
-                continue # Skip to next model
-            
-            print(f"⚠️ Error on {m}: {err_str}")
-            continue
-            
-    print(f"❌ ALL MODELS FAILED. Final error: {last_err}")
-    return "Error: System Overloaded. All AI models are currently busy. Please try again."
+    return await model_rotator.generate(prompt, json_mode=json_mode, hedge=hedge, use_cache=use_cache)
+
+def stream_content_robust(prompt, use_cache=True):
+    """Streaming counterpart of generate_content_robust: an async iterator of text chunks."""
+    return model_rotator.generate_stream(prompt, use_cache=use_cache)
 
 # 2. INITIALIZE AGENTS
 file_store = MongoFileStore(db)
 vault = VaultAgent(mongo_db=db)
-analyst = AnalystAgent(generate_content_robust, vault)
-translator = TranslatorAgent(generate_content_robust)
-active_sessions: Dict[str, dict] = {} 
+analysis_cache = AnalysisCache()
+# Generated code runs in warm worker processes (EXEC_WORKERS, EXEC_TIMEOUT_SECONDS, EXEC_MEMORY_MB)
+exec_engine = ExecEngine()
+analyst = AnalystAgent(generate_content_robust, vault, cache=analysis_cache, engine=exec_engine,
+                       token_budget=model_rotator.prompt_budget, stream_model=stream_content_robust)
+translator = TranslatorAgent(generate_content_robust, stream_model=stream_content_robust)
+
+def recover_session(sid: str):
+    """Cold-session loader for the session cache: rehydrate from GridFS."""
+    r_data, r_type = file_store.load_file(sid)
+    if r_data is None:
+        print(f"⚠️ Session {sid} not found in DB.")
+        return None
+    entry = {**file_store.load_extra(sid), "data": r_data, "type": r_type}
+    if r_type == "structured":
+        saved = entry.pop("profile", None)
+        entry["profile"] = DatasetProfile.from_dict(saved) if saved else DatasetProfile.build(r_data)
+    if r_type == "unstructured":
+        # Postings are rebuilt from the persisted chunk spans
+        entry["doc_index"] = DocumentIndex(r_data, entry.pop("doc_chunks", None), entry.get("page_offsets"))
+    return entry
+
+# Chat history / session metadata leave the request path: batched write-behind
+history = HistoryWriter(db)
+
+# Memory-bounded (SESSION_CACHE_MAX_BYTES), evicted sessions spill to local disk
+active_sessions = SessionCache(loader=recover_session)
+
+def forget_sessions(session_ids):
+    """In-memory state of purged sessions (called from the sweeper's thread)."""
+    for sid in session_ids:
+        active_sessions.pop(sid)
+        vault.invalidate(sid)
+        exec_engine.forget(sid)
+
+# Retention (SESSION_RETENTION_DAYS, MESSAGE_RETENTION_DAYS; both off by default) and deletes run in the background.
+# Each worker starts one; a Mongo lease lets only one of them run the full sweeps.
+sweeper = LifecycleSweeper(db, file_store, vault_store=vault.store, on_purge=forget_sessions)
 
 class AnalyzeRequest(BaseModel):
     text: str
     session_id: Optional[str] = None
     user_email: str = "anonymous"
     translation_mode: str = "mixed"
+    use_cache: bool = True
 
 # 3. ENDPOINTS
 @app.post("/upload")
-async def upload(file: UploadFile = File(...), user_email: str = Header("anonymous")):
+async def upload(file: UploadFile = File(...), user_email: str = Header("anonymous"), compact: bool = Header(COMPACT_DEFAULT)):
     sid = str(uuid.uuid4())
+    path = None
     try:
-        content = await file.read()
-        data, dtype = load_file_universally(file.filename, content)
-        if data is None: return {"error": "Unsupported file format"}
+        # Stream to a temp file instead of buffering the whole upload in memory
+        path = await spool_upload(file)
+        raw_bytes = {}
+        load_meta = {}
+
+        if vault and is_chunkable(file.filename):
+            # CSV chunks / Parquet row groups go through the vault one at a time
+            chunks = iter_structured_chunks(file.filename, path)
+            if compact: chunks = iter_measured(chunks, raw_bytes)
+            data, dtype = await asyncio.to_thread(vault.ingest_chunks, chunks, sid), "structured"
+        else:
+            data, dtype = await asyncio.to_thread(load_file_universally, file.filename, path, load_meta)
+            if data is None: return {"error": "Unsupported file format"}
+
+            if compact and dtype == "structured":
+                raw_bytes = column_bytes(data)
+            if vault and dtype == "structured":
+                data = await asyncio.to_thread(vault.ingest_file, data, sid)
 
-        if vault and dtype == "structured":
-            data = vault.ingest_file(data, session_id=sid)
+        # Analysis cache entries are keyed on this: new data, new version
+        session = {"data": data, "type": dtype, "data_version": uuid.uuid4().hex, **load_meta}
+        if dtype == "unstructured":
+            # Chunk + BM25 index once, so queries only send the relevant excerpts
+            session["doc_index"] = await asyncio.to_thread(DocumentIndex, data, None, load_meta.get("page_offsets"))
+        if compact and dtype == "structured":
+            # After the vault, on the whole frame: one decision per column, and tokenized columns stay tokens
+            data = session["data"] = await asyncio.to_thread(compact_dataframe, data)
+            session["memory_report"] = memory_report(raw_bytes, data)
+            print(f"🗜️ [COMPACT] {file.filename}: {session['memory_report']['total_before']:,} -> {session['memory_report']['total_after']:,} bytes")
         
-        file_store.save_file(sid, data, dtype, file.filename)
-        active_sessions[sid] = {"data": data, "type": dtype}
+        if dtype == "structured":
+            # Schema summary for every later prompt, on the final (tokenized, compacted) frame
+            session["profile"] = await asyncio.to_thread(DatasetProfile.build, data)
 
-        if db is not None:
-            ts = datetime.now().isoformat()
-            db.sessions.insert_one({"session_id": sid, "user_email": user_email, "title": file.filename, "created_at": ts, "file_attached": True})
-            db.messages.insert_one({"session_id": sid, "role": "assistant", "content": f"✅ **{file.filename}** loaded.", "timestamp": ts})
+        extra = {k: v for k, v in session.items() if k not in ("data", "type", "doc_index", "profile")}
+        if "doc_index" in session: extra.update(session["doc_index"].to_extra())
+        if "profile" in session: extra["profile"] = session["profile"].to_dict()
+        await asyncio.to_thread(file_store.save_file, sid, data, dtype, file.filename, extra or None)
+        await asyncio.to_thread(active_sessions.put, sid, session)   # may spill evicted sessions to disk
+
+        ts = datetime.now().isoformat()
+        await history.insert_session({"session_id": sid, "user_email": user_email, "title": file.filename, "created_at": ts, "file_attached": True})
+        await history.add_message({"session_id": sid, "role": "assistant", "content": f"✅ **{file.filename}** loaded.", "timestamp": ts})
 
         return {"analysis": "File Processed", "session_id": sid}
     except Exception as e:
         return {"error": str(e)}
+    finally:
+        if path and os.path.exists(path): os.remove(path)
+
+async def save_history(sid: str, user_text: str, final_resp: str, agent_used: str, user_lang: str, chart_data):
+    """Queued, not written: the history writer batches these off the request path."""
+    ts = datetime.now().isoformat()
+    await history.add_message({"session_id": sid, "role": "user", "content": user_text, "timestamp": ts})
+    await history.add_message({
+        "session_id": sid, 
+        "role": "assistant", 
+        "content": final_resp, 
+        "metadata": {"agent": agent_used, "language": user_lang, "chart": chart_data}, 
+        "timestamp": ts
+    })
+    await history.update_session(sid, {"updated_at": ts})
+
+def request_pipeline(data: AnalyzeRequest, sid: str):
+    """
+    The independent first stages of an analysis, all started at once:
+    session rehydration (memory -> local spill -> GridFS), vault map
+    prefetch, query language detection / translation, and the dataset
+    profile as soon as the session is there.
+    """
+    async def load_session():
+        entry = active_sessions.get(sid)
+        if entry is None and data.session_id:
+            entry = await asyncio.to_thread(active_sessions.load, sid)
+        return entry
+
+    async def load_vault_map():
+        # Warms the vault cache so protect()/restore() don't fetch it on the critical path
+        if data.session_id: await asyncio.to_thread(vault.prefetch, sid)
+
+    async def ensure_profile(entry):
+        # Sessions cached before profiling existed get theirs once, here
+        if entry and entry["type"] == "structured" and entry.get("profile") is None:
+            entry["profile"] = await asyncio.to_thread(DatasetProfile.build, entry["data"])
+        return entry.get("profile") if entry else None
+
+    async def translate_query():
+        return await translator.detect_and_translate(data.text, use_cache=data.use_cache)
+
+    return (StagePipeline()
+            .add("session", load_session)
+            .add("vault_map", load_vault_map)
+            .add("translate", translate_query)
+            .add("profile", ensure_profile, "session"))
 
 @app.post("/analyze")
 async def analyze(data: AnalyzeRequest):
     sid = data.session_id or str(uuid.uuid4())
-    
-    # 1. Recovery
-    if sid not in active_sessions:
-        r_data, r_type = file_store.load_file(sid)
-        if r_data is not None:
-            active_sessions[sid] = {"data": r_data, "type": r_type}
-        else:
-            print(f"⚠️ Session {sid} not found in DB.")
-    
-    session_data = active_sessions.get(sid)
-    
-    try:
-        # A. Translate
-        trans_res = translator.detect_and_translate(data.text)
+    user_lang = "English"
+    chart_data = None
+    cache_level = None
+
+    # 1. Recovery, vault map, profile and query translation run concurrently
+    pipeline = request_pipeline(data, sid)
+
+    # B. Analyze: starts once the session, its vault map, profile and the English query are ready
+    async def analyze_stage(session_data, _vault_map, _profile, trans_res):
         eng_query = trans_res.get("english_query", data.text)
-        user_lang = trans_res.get("detected_language", "English")
-        
-        print(f"🌍 Lang: {user_lang} | Query: {eng_query}")
+        print(f"🌍 Lang: {trans_res.get('detected_language', 'English')} | Query: {eng_query}")
+        if not session_data:
+            raw = await generate_content_robust(f"User Query: {eng_query}", use_cache=data.use_cache)
+            return raw, None, "Liaison", None
 
-        # B. Analyze
-        raw_resp = ""
-        chart_data = None
-        agent_used = "Chat"
-
-        if session_data:
-            agent_used = "Analyst"
-            raw_resp, chart_data = analyst.analyze_data(
-                session_data["data"], 
-                session_data["type"], 
-                eng_query, 
-                sid
-            )
-        else:
-            agent_used = "Liaison"
-            raw_resp = generate_content_robust(f"User Query: {eng_query}")
+        analysis_stats = {}
+        raw, chart = await analyst.analyze_data(
+            session_data["data"], 
+            session_data["type"], 
+            eng_query, 
+            sid,
+            use_cache=data.use_cache,
+            doc_index=session_data.get("doc_index"),
+            data_version=session_data.get("data_version"),
+            profile=session_data.get("profile"),
+            stats=analysis_stats
+        )
+        if analysis_stats.get("cache"): print(f"🗃️ Analysis cache: {analysis_stats['cache']}")
+        return raw, chart, "Analyst", analysis_stats.get("cache")
+
+    # C. Translate Output
+    async def respond_stage(analysis, trans_res):
+        return await translator.translate_response(analysis[0], trans_res.get("detected_language", "English"),
+                                                   mode=data.translation_mode, use_cache=data.use_cache)
 
-        # C. Translate Output
-        # C. Translate Output
-        final_resp = translator.translate_response(raw_resp, user_lang, mode=data.translation_mode)
+    pipeline.add("analyze", analyze_stage, "session", "vault_map", "profile", "translate")
+    pipeline.add("respond", respond_stage, "analyze", "translate")
+
+    try:
+        user_lang = (await pipeline.get("translate")).get("detected_language", "English")
+        _, chart_data, agent_used, cache_level = await pipeline.get("analyze")
+        final_resp = await pipeline.get("respond")
 
         # 🟢 FINAL SAFETY CHECK
         if not final_resp or not final_resp.strip():
             final_resp = "⚠️ The analysis finished, but returned no readable content. Please try rephrasing your request."
 
     except Exception as e:
+        pipeline.cancel()
         final_resp = f"⚠️ System Error: {str(e)}"
         agent_used = "System"
         chart_data = None
+        cache_level = None
+    pipeline.log(f"/analyze {sid[:8]}")
 
     # D. Save History
-    if db is not None:
-        ts = datetime.now().isoformat()
-        db.messages.insert_one({"session_id": sid, "role": "user", "content": data.text, "timestamp": ts})
-        db.messages.insert_one({
-            "session_id": sid, 
-            "role": "assistant", 
-            "content": final_resp, 
-            "metadata": {"agent": agent_used, "language": user_lang, "chart": chart_data}, 
-            "timestamp": ts
-        })
-        db.sessions.update_one({"session_id": sid}, {"$set": {"updated_at": ts}})
-
-    return {"analysis": final_resp, "chart": chart_data, "session_id": sid, "agent": agent_used}
+    await save_history(sid, data.text, final_resp, agent_used, user_lang, chart_data)
+
+    return {"analysis": final_resp, "chart": chart_data, "session_id": sid, "agent": agent_used, "cache": cache_level,
+            "timings": pipeline.timings()}
+
+def sse(event: str, payload):
+    # numpy scalars can show up in chart payloads
+    body = json.dumps(payload, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+    return f"event: {event}\ndata: {body}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_stream(data: AnalyzeRequest):
+    """
+    Server-sent events variant of /analyze. Events, in order:
+    `stage` (progress), `chart` (structured analyses only), `delta` (answer text
+    as it is generated), then `done` with the same fields /analyze returns.
+    """
+    sid = data.session_id or str(uuid.uuid4())
+
+    async def events():
+        pipeline = request_pipeline(data, sid)
+        yield sse("stage", {"stage": "received", "session_id": sid})
+        user_lang, agent_used, chart_data, cache_level = "English", "Chat", None, None
+        parts = []
+        try:
+            # Recovery, vault map, profile and query translation run concurrently
+            yield sse("stage", {"stage": "translating_query"})
+            trans_res = await pipeline.get("translate")
+            eng_query = trans_res.get("english_query", data.text)
+            user_lang = trans_res.get("detected_language", "English")
+            if not pipeline.done("session"):
+                yield sse("stage", {"stage": "loading_session"})
+            session_data = await pipeline.get("session")
+            await pipeline.get("vault_map")
+            await pipeline.get("profile")
+
+            # B. Analyze: structured runs to completion (code + exec), text answers stream
+            source, raw_resp = None, ""
+            if session_data and session_data["type"] == "structured":
+                agent_used = "Analyst"
+                yield sse("stage", {"stage": "analyzing", "agent": agent_used})
+                analysis_stats = {}
+                raw_resp, chart_data = await analyst.analyze_data(
+                    session_data["data"], session_data["type"], eng_query, sid,
+                    use_cache=data.use_cache,
+                    data_version=session_data.get("data_version"),
+                    profile=session_data.get("profile"),
+                    stats=analysis_stats
+                )
+                cache_level = analysis_stats.get("cache")
+                if chart_data: yield sse("chart", chart_data)
+            elif session_data:
+                agent_used = "Analyst"
+                source = analyst.stream_document(session_data["data"], eng_query, sid, use_cache=data.use_cache,
+                                                 doc_index=session_data.get("doc_index"))
+            else:
+                agent_used = "Liaison"
+                source = stream_content_robust(f"User Query: {eng_query}", use_cache=data.use_cache)
+
+            yield sse("stage", {"stage": "responding", "agent": agent_used})
+            if is_english_name(user_lang):
+                # C. No translation: the answer streams straight through
+                if source is None:
+                    parts.append(raw_resp)
+                    yield sse("delta", {"text": raw_resp})
+                else:
+                    async for chunk in source:
+                        parts.append(chunk)
+                        yield sse("delta", {"text": chunk})
+            else:
+                # C. Translate Output: the translation is what streams
+                if source is not None:
+                    raw_resp = "".join([chunk async for chunk in source])
+                async for chunk in translator.translate_response_stream(raw_resp, user_lang, mode=data.translation_mode, use_cache=data.use_cache):
+                    parts.append(chunk)
+                    yield sse("delta", {"text": chunk})
+
+            final_resp = "".join(parts)
+            # 🟢 FINAL SAFETY CHECK
+            if not final_resp.strip():
+                final_resp = "⚠️ The analysis finished, but returned no readable content. Please try rephrasing your request."
+                yield sse("delta", {"text": final_resp})
+        except Exception as e:
+            pipeline.cancel()
+            final_resp = "".join(parts) + f"\n\n⚠️ System Error: {str(e)}"
+            agent_used = "System"
+            yield sse("error", {"message": str(e)})
+        except BaseException:
+            # Client disconnected (CancelledError / GeneratorExit): stop the stages still running
+            pipeline.cancel()
+            raise
+        pipeline.log(f"/analyze/stream {sid[:8]}")
+
+        # D. Save History
+        await save_history(sid, data.text, final_resp, agent_used, user_lang, chart_data)
+        yield sse("done", {"analysis": final_resp, "chart": chart_data, "session_id": sid, "agent": agent_used, "cache": cache_level,
+                           "timings": pipeline.timings()})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.on_event("startup")
+async def startup():
+    await asyncio.to_thread(ensure_indexes, db)
+    history.start()
+    sweeper.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await sweeper.stop()
+    await history.stop()   # flush queued history before exit
+    exec_engine.shutdown()
+    shutdown_pdf_pool()
 
 # Standard Getters
+@app.get("/exec/stats")
+async def exec_stats():
+    return exec_engine.stats()
+
+@app.get("/lifecycle/stats")
+async def lifecycle_stats():
+    return sweeper.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {"llm": prompt_cache.stats(), "analysis": analysis_cache.stats(), "vault_maps": vault.cache_stats(), "sessions": active_sessions.stats(),
+            "history_writes": history.stats()}
+
+@app.get("/models/health")
+async def models_health(json_mode: bool = False):
+    return model_rotator.health(json_mode)
+
+SESSIONS_PAGE_SIZE = int(os.getenv("SESSIONS_PAGE_SIZE", "50"))
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "200"))
+MAX_PAGE_SIZE = 1000
+SESSION_FIELDS = {"_id": 0, "session_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "file_attached": 1}
+
 @app.get("/sessions")
-async def get_sessions(user_email: str = Header(None)):
+async def get_sessions(response: Response, user_email: str = Header(None), limit: int = SESSIONS_PAGE_SIZE, cursor: Optional[str] = None):
+    """
+    Newest first, `limit` per page. When more exist, the X-Next-Cursor
+    header holds the `cursor` for the next page (keyset on created_at, session_id).
+    """
     if db is None or not user_email: return []
+    await history.flush_for(user_email=user_email)   # read-your-writes for this user's new sessions
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"user_email": user_email, "deleted_at": {"$exists": False}}
+    try: after = decode_cursor(cursor)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    if after: query.update(keyset_filter("created_at", "session_id", after, descending=True))
     try:
-        cursor = db.sessions.find({"user_email": user_email}).sort("created_at", -1)
-        return [{**{k:v for k,v in d.items() if k!="_id"}, "id": d["session_id"]} for d in cursor]
-    except: return []
+        docs = list(db.sessions.find(query, SESSION_FIELDS)
+                    .sort([("created_at", -1), ("session_id", -1)]).limit(limit + 1))
+    except Exception as e:
+        print(f"⚠️ Session list failed: {e}")
+        return []
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1].get("created_at"), docs[-1]["session_id"])
+    return [{**d, "id": d["session_id"]} for d in docs]
 
 @app.get("/sessions/{sid}/messages")
-async def get_messages(sid: str):
+async def get_messages(sid: str, response: Response, limit: int = MESSAGES_PAGE_SIZE, cursor: Optional[str] = None,
+                       since: Optional[str] = None, charts: bool = True):
+    """
+    Oldest first, `limit` per page. X-Next-Cursor is the position after the
+    last returned message: pass it back as `cursor` for the next page, or to
+    poll for new messages only. `since` (ISO timestamp) returns messages newer
+    than it. `charts=false` leaves chart payloads out.
+    """
     if db is None: return []
-    cursor = db.messages.find({"session_id": sid}).sort("timestamp", 1)
-    return [{**{k:v for k,v in d.items() if k!="_id"}, "id": str(d["_id"])} for d in cursor]
+    await history.flush_for(sid)   # read-your-writes
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"session_id": sid}
+    try: after = decode_cursor(cursor)
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    if after: query.update(keyset_filter("timestamp", "_id", after))
+    elif since: query["timestamp"] = {"$gt": since}   # ISO strings sort chronologically
+    projection = None if charts else {"metadata.chart": 0}
+    docs = list(db.messages.find(query, projection).sort([("timestamp", 1), ("_id", 1)]).limit(limit))
+    if docs:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1].get("timestamp"), docs[-1]["_id"])
+    elif cursor:
+        response.headers["X-Next-Cursor"] = cursor   # nothing new yet: keep polling from the same spot
+    return [{**{k:v for k,v in d.items() if k!="_id"}, "id": str(d["_id"])} for d in docs]
 
 @app.delete("/sessions/{sid}")
 async def delete_session(sid: str):
+    """Marks the session deleted; the lifecycle sweeper purges its data in the background."""
     if db is None: return {"error": "DB not connected"}
-    db.sessions.delete_one({"session_id": sid})
-    db.messages.delete_many({"session_id": sid})
-    db.vault_mappings.delete_one({"session_id": sid})
+    await history.flush_for(sid)   # queued writes must not land after the purge
     try:
-        fdoc = db.file_mappings.find_one({"session_id": sid})
-        if fdoc: 
-            __import__('gridfs').GridFS(db).delete(fdoc['file_id'])
-            db.file_mappings.delete_one({"session_id": sid})
-    except: pass
-    active_sessions.pop(sid, None)
+        await asyncio.to_thread(sweeper.mark_deleted, sid)
+    except Exception as e:
+        return {"error": f"Delete failed: {e}"}
+    forget_sessions([sid])
     return {"status": "success"}
 
 if __name__ == "__main__":
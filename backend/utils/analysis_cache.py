@@ -0,0 +1,59 @@
+# backend/utils/analysis_cache.py
+import os
+import re
+import sys
+import hashlib
+
+from utils.lru_cache import LRUCache
+
+
+def _result_bytes(value):
+    result, chart = value
+    return sys.getsizeof(result) + (len(repr(chart)) if chart else 0)
+
+
+class AnalysisCache:
+    """
+    Two-level cache for AnalystAgent, keyed by dataset version + protected query.
+    - Level 1 (code): the generated pandas code, so a repeat skips the LLM call.
+    - Level 2 (result): the executed (result, chart_data), still tokenized,
+      so a repeat skips exec as well.
+    A new upload gets a new dataset version, so entries for old data are
+    never looked up again and age out of the LRU.
+    """
+    def __init__(self, max_entries: int = None, max_result_bytes: int = None, ttl: float = None):
+        max_entries = max_entries or int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "1024"))
+        ttl = ttl or float(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+        max_result_bytes = max_result_bytes or int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 ** 2)))
+        self.code = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.results = LRUCache(max_entries=max_entries, max_bytes=max_result_bytes, ttl=ttl, sizeof=_result_bytes)
+
+    @staticmethod
+    def make_key(data_version: str, safe_query: str):
+        # Whitespace only: case matters to literal filters (== 'ABC' vs == 'abc')
+        normalized = re.sub(r"\s+", " ", safe_query).strip()
+        return hashlib.sha256(f"{data_version}|{normalized}".encode("utf-8")).hexdigest()
+
+    def get_result(self, key: str):
+        return self.results.get(key)
+
+    def get_code(self, key: str):
+        return self.code.get(key)
+
+    def set_code(self, key: str, code: str):
+        self.code.set(key, code)
+
+    def set_result(self, key: str, result, chart_data):
+        self.results.set(key, (result, chart_data))
+
+    def stats(self):
+        code, results = self.code.stats(), self.results.stats()
+        return {
+            "result_hits": results["hits"],
+            "code_hits": code["hits"],
+            # A code lookup only happens after a result miss
+            "misses": code["misses"],
+            "result_entries": results["entries"],
+            "result_bytes": results["bytes"],
+            "code_entries": code["entries"],
+        }
@@ -0,0 +1,39 @@
+# backend/utils/db_indexes.py
+from pymongo import ASCENDING, DESCENDING
+
+# (collection, keys, options) for every query the backend runs on the hot path
+INDEXES = [
+    # /sessions: one user's sessions, newest first, keyset on (created_at, session_id)
+    ("sessions", [("user_email", ASCENDING), ("created_at", DESCENDING), ("session_id", DESCENDING)], {}),
+    ("sessions", [("session_id", ASCENDING)], {"unique": True}),
+    # Lifecycle sweeper: deleted / idle sessions
+    ("sessions", [("deleted_at", ASCENDING)], {"sparse": True}),
+    ("sessions", [("updated_at", ASCENDING)], {}),
+    ("sessions", [("created_at", ASCENDING)], {}),
+    # /sessions/{sid}/messages: one session's messages in order, keyset on (timestamp, _id)
+    ("messages", [("session_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)], {}),
+    ("messages", [("timestamp", ASCENDING)], {}),
+    ("vault_mappings", [("session_id", ASCENDING)], {"unique": True}),
+    ("vault_entries", [("session_id", ASCENDING), ("token", ASCENDING)], {"unique": True}),
+    ("vault_entries", [("session_id", ASCENDING), ("key", ASCENDING)], {"partialFilterExpression": {"key": {"$exists": True}}}),
+    ("file_mappings", [("session_id", ASCENDING)], {"unique": True}),
+    ("file_mappings", [("file_id", ASCENDING)], {}),   # GridFS orphan reconciliation
+]
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes above (a no-op for ones that already exist).
+    Each index is attempted separately: one failure (e.g. duplicates blocking
+    a unique index on old data) is logged and doesn't stop the rest.
+    """
+    if db is None: return 0
+    created = 0
+    for collection, keys, options in INDEXES:
+        try:
+            db[collection].create_index(keys, **options)
+            created += 1
+        except Exception as e:
+            print(f"⚠️ [INDEXES] {collection} {[k for k, _ in keys]}: {e}")
+    print(f"🗂️ [INDEXES] {created}/{len(INDEXES)} indexes in place")
+    return created
@@ -0,0 +1,126 @@
+# backend/utils/doc_index.py
+import os
+import re
+import sys
+import math
+import bisect
+import numpy as np
+from collections import Counter
+
+CHUNK_CHARS = int(os.getenv("DOC_CHUNK_CHARS", "1500"))
+CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "200"))
+TOP_K = int(os.getenv("DOC_TOP_K", "6"))
+CONTEXT_CHARS = int(os.getenv("DOC_CONTEXT_CHARS", "12000"))
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str):
+    return WORD_PATTERN.findall(text.lower())
+
+
+def chunk_spans(text: str, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP):
+    """
+    (start, end) offsets of overlapping chunks. Cuts prefer a paragraph,
+    line, sentence or word break in the last third of each chunk.
+    """
+    spans, start, n = [], 0, len(text)
+    while start < n:
+        end = min(start + chunk_chars, n)
+        if end < n:
+            floor = start + (chunk_chars * 2) // 3
+            for sep in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(sep, floor, end)
+                if cut > 0:
+                    end = cut + len(sep)
+                    break
+        spans.append((start, end))
+        if end >= n: break
+        # Overlap starts on a word boundary
+        nxt = text.find(" ", end - overlap, end)
+        start = nxt + 1 if nxt > start else end
+    return spans
+
+
+class DocumentIndex:
+    """
+    BM25 lexical index over the chunks of one document, built at upload.
+    Holds only offsets and postings: chunk text is sliced from the session's
+    document on demand. Persisted as its chunk spans (postings are rebuilt
+    from the text on recovery, a single tokenization pass).
+    """
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, text: str, spans=None, page_offsets=None):
+        self.spans = [tuple(s) for s in spans] if spans else chunk_spans(text)
+        self.pages = self._chunk_pages(page_offsets)
+
+        postings, lengths = {}, []
+        for i, (s, e) in enumerate(self.spans):
+            counts = Counter(tokenize(text[s:e]))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((i, tf))
+
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.avg_len = float(self.lengths.mean()) if len(lengths) else 0.0
+        self.postings = {
+            term: (np.fromiter((i for i, _ in p), dtype=np.int32, count=len(p)),
+                   np.fromiter((tf for _, tf in p), dtype=np.float32, count=len(p)))
+            for term, p in postings.items()
+        }
+
+    def _chunk_pages(self, page_offsets):
+        """Page number each chunk starts on (PDFs only)."""
+        if not page_offsets: return None
+        starts = [p["start"] for p in page_offsets]
+        return [page_offsets[max(bisect.bisect_right(starts, s) - 1, 0)]["page"] for s, _ in self.spans]
+
+    def search(self, query: str, k: int = TOP_K):
+        """[(chunk_idx, score)] best first; only chunks sharing a term with the query."""
+        if not self.spans: return []
+        n = len(self.spans)
+        scores = np.zeros(n, dtype=np.float32)
+        norm = self.K1 * (1 - self.B + self.B * self.lengths / (self.avg_len or 1.0))
+        for term in set(tokenize(query)):
+            hit = self.postings.get(term)
+            if hit is None: continue
+            idx, tf = hit
+            idf = math.log(1 + (n - len(idx) + 0.5) / (len(idx) + 0.5))
+            scores[idx] += idf * tf * (self.K1 + 1) / (tf + norm[idx])
+
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def context(self, text: str, query: str, k: int = TOP_K, max_chars: int = CONTEXT_CHARS):
+        """
+        Prompt excerpt: the top-k chunks (in document order, labelled with
+        their page when known) up to `max_chars`. Falls back to the start of
+        the document when nothing matches.
+        """
+        if len(text) <= max_chars: return text
+
+        picked, used = [], 0
+        for i, _ in self.search(query, k):
+            s, e = self.spans[i]
+            if used + (e - s) > max_chars: continue
+            picked.append(i)
+            used += e - s
+        if not picked:
+            return text[:max_chars]
+
+        parts = []
+        for i in sorted(picked):
+            s, e = self.spans[i]
+            label = f"[Page {self.pages[i]}]" if self.pages else f"[Excerpt {i + 1}/{len(self.spans)}]"
+            parts.append(f"{label}\n{text[s:e].strip()}")
+        return "\n\n...\n\n".join(parts)
+
+    def to_extra(self):
+        """What gets persisted with the session's file mapping."""
+        return {"doc_chunks": [list(s) for s in self.spans]}
+
+    def approx_bytes(self):
+        arrays = sum(idx.nbytes + tf.nbytes for idx, tf in self.postings.values())
+        return arrays + 100 * len(self.postings) + 64 * len(self.spans) + sys.getsizeof(self)
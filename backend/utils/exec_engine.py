@@ -0,0 +1,355 @@
+# backend/utils/exec_engine.py
+import io
+import os
+import sys
+import uuid
+import time
+import shutil
+import pickle
+import asyncio
+import tempfile
+import threading
+import contextlib
+import subprocess
+import multiprocessing
+from multiprocessing.connection import Connection
+from collections import OrderedDict
+
+import pandas as pd
+
+from utils.lru_cache import LRUCache
+
+try:
+    import resource
+except ImportError:   # Windows: no RLIMIT_AS, wall-clock limit only
+    resource = None
+
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXEC_TIMEOUT_SECONDS = float(os.getenv("EXEC_TIMEOUT_SECONDS", "60"))
+EXEC_MEMORY_MB = int(os.getenv("EXEC_MEMORY_MB", "4096"))
+EXEC_FRAME_FILES = int(os.getenv("EXEC_FRAME_FILES", "64"))
+EXEC_FRAME_MAX_BYTES = int(os.getenv("EXEC_FRAME_MAX_BYTES", str(4 * 1024 ** 3)))   # on-disk budget for shared frames
+STALE_FRAME_SECONDS = 3600   # loose frame files older than this are leftovers of a dead server
+WORKER_FRAMES = 2   # frames each worker keeps loaded between tasks
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ExecTimeout(Exception):
+    pass
+
+
+def _pid_alive(pid: int):
+    if os.name != "posix": return True   # os.kill would terminate it on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:   # exists but not ours (PermissionError)
+        return True
+    return True
+
+
+# =========================================================
+# 🟢 FRAME SHARING (Arrow IPC files, memory-mapped by workers)
+# =========================================================
+def write_frame(df: pd.DataFrame, path: str):
+    """Arrow IPC (uncompressed, so workers can memory-map it); pickle for frames Arrow can't encode."""
+    tmp = path + ".tmp"
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df)
+        with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        fmt = "arrow"
+    except Exception:
+        with open(tmp, "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        fmt = "pickle"
+    os.replace(tmp, path)
+    return fmt
+
+
+def read_frame(path: str, fmt: str):
+    if fmt == "arrow":
+        import pyarrow as pa
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+# =========================================================
+# 🟢 WORKER PROCESS
+# =========================================================
+def _worker_main(conn, memory_bytes: int):
+    if memory_bytes and resource is not None:
+        try: resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        except (ValueError, OSError): pass
+    try: pd.set_option("mode.copy_on_write", True)   # tasks get shallow copies of the cached frame
+    except Exception: pass
+
+    frames = OrderedDict()   # frame_key -> DataFrame, small LRU
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            conn.send(_run_task(task, frames))
+        except Exception as e:
+            # Usually an unpicklable chart_data
+            conn.send({"ok": False, "error": f"Result could not be returned: {e}", "stdout": ""})
+
+
+def _load(task: dict, frames: OrderedDict):
+    key = task["frame_key"]
+    if key in frames:
+        frames.move_to_end(key)
+        return frames[key]
+    df = read_frame(task["frame_path"], task["frame_format"])
+    if task.get("keep", True):
+        frames[key] = df
+        while len(frames) > WORKER_FRAMES: frames.popitem(last=False)
+    return df
+
+
+def _run_task(task: dict, frames: OrderedDict):
+    stdout = io.StringIO()
+    try:
+        df = _load(task, frames)
+        local_env = {"df": df.copy(deep=False), "pd": pd, "result": None, "chart_data": None}
+        with contextlib.redirect_stdout(stdout):
+            exec(task["code"], {}, local_env)
+    except BaseException as e:
+        # MemoryError from RLIMIT_AS lands here too; the worker stays usable
+        return {"ok": False, "error": f"{type(e).__name__}: {e}" if isinstance(e, MemoryError) else str(e), "stdout": stdout.getvalue()}
+
+    result = local_env.get("result")
+    return {
+        "ok": True,
+        "result": None if result is None else str(result),
+        "chart_data": local_env.get("chart_data"),
+        "stdout": stdout.getvalue(),
+    }
+
+
+class _Worker:
+    """
+    One warm worker process. On POSIX it is a fresh `python -m utils.exec_engine`
+    talking over an inherited pipe, so it never re-imports the server's main
+    module (multiprocessing's spawn would re-run main.py in every worker).
+    """
+    def __init__(self, memory_bytes: int):
+        parent, child = multiprocessing.Pipe()
+        if os.name == "posix":
+            fd = child.fileno()
+            self.proc = subprocess.Popen(
+                [sys.executable, "-m", "utils.exec_engine", str(fd), str(memory_bytes)],
+                cwd=BACKEND_DIR, pass_fds=(fd,)
+            )
+        else:
+            self.proc = multiprocessing.get_context("spawn").Process(target=_worker_main, args=(child, memory_bytes), daemon=True)
+            self.proc.start()
+        child.close()
+        self.conn = parent
+        self._lock = threading.Lock()   # one round-trip at a time on the pipe
+
+    def run(self, task: dict, timeout: float):
+        """Blocking round-trip. Raises ExecTimeout (worker killed) or EOFError (worker died)."""
+        with self._lock:
+            self.conn.send(task)
+            if not self.conn.poll(timeout):
+                self.kill()
+                raise ExecTimeout(f"Analysis exceeded {timeout:.0f}s")
+            return self.conn.recv()
+
+    def alive(self):
+        return self.proc.poll() is None if isinstance(self.proc, subprocess.Popen) else self.proc.is_alive()
+
+    def terminate(self):
+        """Stops the process but leaves the pipe open: a round-trip in flight gets EOFError instead of a result."""
+        if self.alive(): self.proc.kill()
+
+    def kill(self):
+        if self.alive(): self.proc.kill()
+        if isinstance(self.proc, subprocess.Popen): self.proc.wait(timeout=5)
+        else: self.proc.join(timeout=5)
+        self.conn.close()
+
+
+# =========================================================
+# 🟢 ENGINE
+# =========================================================
+class ExecEngine:
+    """
+    Runs generated analyst code in a pool of warm worker processes.
+    - Session frames are written once per (session, data version) as Arrow
+      IPC files; workers memory-map them and keep the last few loaded, so
+      repeat questions don't re-ship the data. The files are bounded by
+      EXEC_FRAME_FILES and EXEC_FRAME_MAX_BYTES, and live in a per-process
+      directory; leftovers of dead processes are cleared at startup.
+    - Per-task wall-clock limit (the worker is killed and replaced) and an
+      address-space limit per worker (RLIMIT_AS, POSIX only).
+    - stdout is captured per task inside the worker.
+    - `await run(...)` never blocks the event loop.
+    `workers=0` runs tasks inline in a thread (debugging only: no isolation).
+    """
+    def __init__(self, workers: int = None, timeout: float = None, memory_mb: int = None, frame_dir: str = None):
+        self.workers = EXEC_WORKERS if workers is None else workers
+        self.timeout = timeout or EXEC_TIMEOUT_SECONDS
+        self.memory_bytes = (EXEC_MEMORY_MB if memory_mb is None else memory_mb) * 1024 ** 2
+        # One subdirectory per server process: uvicorn workers share the base dir
+        self.base_dir = frame_dir or os.getenv("EXEC_FRAME_DIR", os.path.join(tempfile.gettempdir(), "nexus_frames"))
+        self.frame_dir = os.path.join(self.base_dir, f"proc-{os.getpid()}")
+        self._clear_stale_frames()
+        os.makedirs(self.frame_dir, exist_ok=True)
+        self._idle = None   # asyncio.Queue of _Worker, created on first use (needs the running loop)
+        self._frames = LRUCache(max_entries=EXEC_FRAME_FILES, max_bytes=EXEC_FRAME_MAX_BYTES,
+                                sizeof=self._frame_bytes, on_evict=self._drop_frame)
+        self._write_lock = threading.Lock()
+        self.tasks = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    # --- Frames ---
+    def _clear_stale_frames(self):
+        """
+        Removes frame files left behind by crashed or killed servers: the
+        directories of processes that are gone (and this pid's own, from a
+        previous run), and loose *.arrow / *.tmp files past STALE_FRAME_SECONDS.
+        """
+        if not os.path.isdir(self.base_dir): return
+        removed = 0
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            try:
+                if name.startswith("proc-") and os.path.isdir(path):
+                    pid = int(name[len("proc-"):]) if name[len("proc-"):].isdigit() else None
+                    if pid is not None and pid != os.getpid() and _pid_alive(pid): continue
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+                elif name.endswith((".arrow", ".tmp")) and time.time() - os.path.getmtime(path) > STALE_FRAME_SECONDS:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+        if removed: print(f"🧹 [EXEC] Cleared {removed} stale frame files/dirs in {self.base_dir}")
+
+    @staticmethod
+    def _frame_bytes(value):
+        try: return os.path.getsize(value[0])
+        except OSError: return 0
+
+    def _drop_frame(self, key, value):
+        path, _ = value
+        if os.path.exists(path):
+            try: os.remove(path)
+            except OSError: pass
+
+    def _share(self, df: pd.DataFrame, frame_key: str):
+        """(path, format) of the frame's shared file, writing it once per key."""
+        with self._write_lock:
+            shared = self._frames.get(frame_key)
+            if shared is None:
+                path = os.path.join(self.frame_dir, f"{uuid.uuid4().hex}.arrow")
+                shared = (path, write_frame(df, path))
+                self._frames.set(frame_key, shared)
+            return shared
+
+    def forget(self, session_id: str):
+        """Drops shared frame files of a deleted session."""
+        for key in self._frames.keys():
+            if key.startswith(f"{session_id}-"):
+                value = self._frames.pop(key)
+                if value: self._drop_frame(key, value)
+
+    # --- Workers ---
+    def _ensure_pool(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.workers):
+                self._idle.put_nowait(_Worker(self.memory_bytes))
+            print(f"⚙️ [EXEC] Started {self.workers} worker processes")
+
+    def _run_blocking(self, worker: _Worker, df, code: str, frame_key: str, timeout: float):
+        keep = frame_key is not None
+        frame_key = frame_key or f"adhoc-{uuid.uuid4().hex}"
+        path, fmt = self._share(df, frame_key)
+        task = {"code": code, "frame_key": frame_key, "frame_path": path, "frame_format": fmt, "keep": keep}
+        try:
+            return worker.run(task, timeout)
+        finally:
+            if not keep:
+                self._drop_frame(frame_key, self._frames.pop(frame_key))
+
+    async def run(self, code: str, df: pd.DataFrame, frame_key: str = None, timeout: float = None):
+        """
+        Executes `code` with `df`, `pd`, `result` and `chart_data` in scope.
+        Returns {"ok", "result", "chart_data", "stdout"} or {"ok": False, "error", "stdout"}.
+        `frame_key` must change whenever the frame's data does (e.g. session id + data version).
+        Raises ExecTimeout when the wall-clock limit is hit.
+        """
+        timeout = timeout or self.timeout
+        self.tasks += 1
+        if self.workers <= 0:
+            return await asyncio.to_thread(_run_task, {"code": code, "frame_key": "inline"}, {"inline": df})
+
+        self._ensure_pool()
+        worker = await self._idle.get()
+        if not worker.alive():
+            worker = self._replace(worker)
+        round_trip = asyncio.ensure_future(asyncio.to_thread(self._run_blocking, worker, df, code, frame_key, timeout))
+        try:
+            outcome = await asyncio.shield(round_trip)
+        except asyncio.CancelledError:
+            # The thread still owns the worker's pipe: stop the worker now, and
+            # only hand a fresh one to the pool once that thread has finished
+            worker.terminate()
+            round_trip.add_done_callback(lambda f: self._retire(worker, f))
+            raise
+        except ExecTimeout:
+            self.timeouts += 1
+            self._idle.put_nowait(self._replace(worker))
+            raise
+        except (EOFError, OSError, BrokenPipeError) as e:
+            # Worker crashed mid-task (e.g. killed by the OS)
+            self._idle.put_nowait(self._replace(worker))
+            return {"ok": False, "error": f"Execution worker crashed: {str(e) or 'no response'}", "stdout": ""}
+        except BaseException:
+            self._idle.put_nowait(worker)
+            raise
+        self._idle.put_nowait(worker)
+        return outcome
+
+    def _retire(self, worker: _Worker, round_trip):
+        """Done-callback for a cancelled task's round-trip: replaces its worker."""
+        if not round_trip.cancelled(): round_trip.exception()   # mark as retrieved
+        self._idle.put_nowait(self._replace(worker))
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        self.restarts += 1
+        return _Worker(self.memory_bytes)
+
+    def shutdown(self):
+        if self._idle is not None:
+            while not self._idle.empty():
+                self._idle.get_nowait().kill()
+        for key in self._frames.keys():
+            self._drop_frame(key, self._frames.pop(key))
+        shutil.rmtree(self.frame_dir, ignore_errors=True)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "tasks": self.tasks,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "shared_frames": len(self._frames),
+            "shared_frame_bytes": self._frames.bytes,
+        }
+
+
+if __name__ == "__main__":
+    # Worker entry point: python -m utils.exec_engine <pipe fd> <memory bytes>
+    _worker_main(Connection(int(sys.argv[1])), int(sys.argv[2]))
@@ -1,48 +1,247 @@
 # backend/utils/file_store.py
+import io
+import os
 import pickle
+import tempfile
 import gridfs
-from datetime import datetime
+import pandas as pd
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+
+# GridFS chunk size for session blobs: fewer, larger round-trips than the 255KB default
+GRIDFS_CHUNK_BYTES = 1024 * 1024
+
+# Bookkeeping fields of a file_mappings doc; everything else came in through `extra`
+MAPPING_FIELDS = {"session_id", "filename", "data_type", "format", "file_id", "updated_at"}
 
 class MongoFileStore:
-    def __init__(self, db):
+    """
+    Session persistence in GridFS.
+    - Structured sessions are stored as zstd-compressed Parquet (columnar,
+      pandas-version independent); frames pyarrow can't encode fall back to pickle.
+    - A local on-disk cache keeps recently used Parquet files, memory-mapped on
+      load, so restarts don't re-download from Atlas and loads can read
+      only the columns they need.
+    """
+    def __init__(self, db, cache_dir: str = None, cache_max_bytes: int = None):
         self.db = db
         if db is not None:
             self.fs = gridfs.GridFS(db)
+        self.cache_dir = cache_dir or os.getenv("SESSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nexus_sessions"))
+        self.cache_max_bytes = cache_max_bytes or int(os.getenv("SESSION_CACHE_DISK_BYTES", str(5 * 1024 ** 3)))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except Exception as e:
+            print(f"⚠️ Local session cache disabled: {e}")
+            self.cache_dir = None
+
+    # --- Local cache ---
+    def _local_path(self, session_id: str, file_id):
+        if not self.cache_dir: return None
+        return os.path.join(self.cache_dir, f"{session_id}-{file_id}.parquet")
+
+    def _write_local(self, path: str, df: pd.DataFrame):
+        # Write to a temp name and rename, so a crash never leaves a half file behind
+        tmp = path + ".tmp"
+        df.to_parquet(tmp, compression="zstd")
+        os.replace(tmp, path)
+
+    def _prune_local(self):
+        """Keeps the local cache under its byte budget, dropping least recently used files."""
+        try:
+            # Staging / .tmp files belong to saves in progress: never prune those
+            files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir)
+                     if f.endswith(".parquet") and not f.endswith("-staging.parquet")]
+            stats = sorted(((os.stat(f).st_atime, os.path.getsize(f), f) for f in files))
+            total = sum(s for _, s, _ in stats)
+            for _, size, f in stats:
+                if total <= self.cache_max_bytes: break
+                os.remove(f)
+                total -= size
+        except Exception as e:
+            print(f"⚠️ Local cache prune failed: {e}")
+
+    def _drop_local(self, session_id: str):
+        if not self.cache_dir: return
+        for f in os.listdir(self.cache_dir):
+            if f.startswith(f"{session_id}-"):
+                try: os.remove(os.path.join(self.cache_dir, f))
+                except OSError: pass
+
+    @staticmethod
+    def _read_parquet(source, columns=None):
+        return pd.read_parquet(source, columns=columns, memory_map=isinstance(source, str))
 
-    def save_file(self, session_id: str, data, data_type: str, filename: str):
+    # --- GridFS ---
+    def save_file(self, session_id: str, data, data_type: str, filename: str, extra: dict = None):
+        """Persists a session; `extra` fields (e.g. memory_report) are stored on its file_mappings doc."""
         if self.db is None: return False
         try:
             # Cleanup old
             old = self.db.file_mappings.find_one({"session_id": session_id})
-            if old: 
+            if old:
                 try: self.fs.delete(old['file_id'])
                 except: pass
+                self._drop_local(session_id)
 
-            content = pickle.dumps(data) if data_type == "structured" else data.encode('utf-8')
-            file_id = self.fs.put(content, filename=filename)
+            fmt = "text"
+            local_path = None
+            if data_type == "structured":
+                file_id, fmt, local_path = self._put_frame(session_id, data, filename)
+            else:
+                file_id = self.fs.put(data.encode('utf-8'), filename=filename, chunkSize=GRIDFS_CHUNK_BYTES)
 
             self.db.file_mappings.update_one(
                 {"session_id": session_id},
-                {"$set": {"session_id": session_id, "filename": filename, "data_type": data_type, "file_id": file_id, "updated_at": datetime.now()}},
+                {"$set": {**(extra or {}), "session_id": session_id, "filename": filename, "data_type": data_type, "format": fmt, "file_id": file_id, "updated_at": datetime.now()}},
                 upsert=True
             )
+            if local_path:
+                # GridFS and the mapping are written: a failed local copy only costs a re-download
+                try:
+                    os.replace(local_path, self._local_path(session_id, file_id))
+                    self._prune_local()
+                except OSError as e:
+                    print(f"⚠️ Local cache copy skipped: {e}")
             return True
         except Exception as e:
             print(f"❌ Save Error: {e}")
             return False
 
-    def load_file(self, session_id: str):
+    def _put_frame(self, session_id: str, df: pd.DataFrame, filename: str):
+        """Encodes a frame as Parquet (on local disk when cached), then streams it into GridFS chunk by chunk."""
+        staging = None
+        try:
+            if self.cache_dir:
+                staging = os.path.join(self.cache_dir, f"{session_id}-staging.parquet")
+                self._write_local(staging, df)
+                with open(staging, "rb") as src:
+                    file_id = self.fs.put(src, filename=filename, chunkSize=GRIDFS_CHUNK_BYTES)
+                return file_id, "parquet", staging
+
+            buf = io.BytesIO()
+            df.to_parquet(buf, compression="zstd")
+            buf.seek(0)
+            return self.fs.put(buf, filename=filename, chunkSize=GRIDFS_CHUNK_BYTES), "parquet", None
+        except Exception as e:
+            print(f"⚠️ Parquet encode failed ({e}), falling back to pickle.")
+            if staging:
+                for f in (staging, staging + ".tmp"):
+                    if os.path.exists(f): os.remove(f)
+
+        file_id = self.fs.put(pickle.dumps(df), filename=filename, chunkSize=GRIDFS_CHUNK_BYTES)
+        return file_id, "pickle", None
+
+    def load_file(self, session_id: str, columns=None):
+        """
+        Returns (data, data_type). `columns` limits a structured load to those
+        columns (Parquet sessions only; pickled ones are filtered after load).
+        """
         if self.db is None: return None, None
         try:
             mapping = self.db.file_mappings.find_one({"session_id": session_id})
             if not mapping: return None, None
-            
-            grid_out = self.fs.get(mapping['file_id'])
-            content = grid_out.read()
-            
-            if mapping["data_type"] == "structured":
-                return pickle.loads(content), "structured"
-            return content.decode('utf-8'), "unstructured"
+
+            if mapping["data_type"] != "structured":
+                return self.fs.get(mapping['file_id']).read().decode('utf-8'), "unstructured"
+
+            if mapping.get("format") == "parquet":
+                return self._load_parquet(session_id, mapping['file_id'], columns), "structured"
+
+            # Legacy pickle blobs
+            df = pickle.loads(self.fs.get(mapping['file_id']).read())
+            return (df[columns] if columns else df), "structured"
         except Exception as e:
             print(f"❌ Load Error: {e}")
-            return None, None
\ No newline at end of file
+            return None, None
+
+    def load_extra(self, session_id: str):
+        """The `extra` fields saved alongside a session (memory_report, page_offsets...)."""
+        if self.db is None: return {}
+        mapping = self.db.file_mappings.find_one({"session_id": session_id}, {"_id": 0})
+        if not mapping: return {}
+        extra = {k: v for k, v in mapping.items() if k not in MAPPING_FIELDS}
+        # Sessions saved before data versions existed: the blob id changes on every save too
+        extra.setdefault("data_version", str(mapping["file_id"]))
+        return extra
+
+    def _load_parquet(self, session_id: str, file_id, columns=None):
+        path = self._local_path(session_id, file_id)
+        if path and os.path.exists(path):
+            os.utime(path)   # LRU bookkeeping for _prune_local
+            return self._read_parquet(path, columns)
+
+        grid_out = self.fs.get(file_id)
+        if not path:
+            return self._read_parquet(grid_out, columns)
+
+        # Cold load: stream GridFS chunks to the local cache, then memory-map it
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as dst:
+            for chunk in grid_out:
+                dst.write(chunk)
+        os.replace(tmp, path)
+        self._prune_local()
+        return self._read_parquet(path, columns)
+
+    def delete_file(self, session_id: str):
+        """Removes a session's blob, its mapping and any local cache copy."""
+        self._drop_local(session_id)
+        if self.db is None: return
+        fdoc = self.db.file_mappings.find_one({"session_id": session_id})
+        if fdoc:
+            self.fs.delete(fdoc['file_id'])
+            self.db.file_mappings.delete_one({"session_id": session_id})
+
+    def delete_files(self, session_ids):
+        """
+        Batch delete for the lifecycle sweeper. Returns the number of GridFS
+        blobs that failed to delete; their mappings are removed anyway and
+        reconcile_orphans() collects the leftovers later.
+        """
+        session_ids = list(session_ids)
+        for sid in session_ids: self._drop_local(sid)
+        if self.db is None or not session_ids: return 0
+        failed = 0
+        mappings = self.db.file_mappings.find({"session_id": {"$in": session_ids}}, {"file_id": 1})
+        for fdoc in mappings:
+            try: self.fs.delete(fdoc["file_id"])
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ GridFS delete failed for {fdoc['file_id']}: {e}")
+        self.db.file_mappings.delete_many({"session_id": {"$in": session_ids}})
+        return failed
+
+    def reconcile_orphans(self, grace_seconds: float, limit: int = 500):
+        """
+        Removes GridFS data nothing points at, older than `grace_seconds`
+        (uploads in progress write chunks before their files doc, and blobs
+        before their mapping):
+        - fs.chunks whose fs.files document is gone;
+        - fs.files no file_mappings document refers to.
+        Returns (orphan chunk groups, orphan files) removed.
+        """
+        if self.db is None: return 0, 0
+        cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=grace_seconds))
+
+        lost_chunks = [d["_id"] for d in self.db["fs.chunks"].aggregate([
+            {"$match": {"files_id": {"$lt": cutoff}}},
+            {"$group": {"_id": "$files_id"}},
+            {"$lookup": {"from": "fs.files", "localField": "_id", "foreignField": "_id", "as": "file"}},
+            {"$match": {"file": {"$size": 0}}},
+            {"$limit": limit},
+        ], allowDiskUse=True)]
+        if lost_chunks:
+            self.db["fs.chunks"].delete_many({"files_id": {"$in": lost_chunks}})
+
+        lost_files = [d["_id"] for d in self.db["fs.files"].aggregate([
+            {"$match": {"_id": {"$lt": cutoff}}},
+            {"$lookup": {"from": "file_mappings", "localField": "_id", "foreignField": "file_id", "as": "mapping"}},
+            {"$match": {"mapping": {"$size": 0}}},
+            {"$project": {"_id": 1}},
+            {"$limit": limit},
+        ], allowDiskUse=True)]
+        for file_id in lost_files:
+            try: self.fs.delete(file_id)
+            except Exception as e: print(f"⚠️ GridFS orphan delete failed for {file_id}: {e}")
+        return len(lost_chunks), len(lost_files)
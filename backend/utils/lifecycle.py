@@ -0,0 +1,181 @@
+# backend/utils/lifecycle.py
+import os
+import time
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+# Retention in days; 0 (the default) keeps forever. Set e.g. SESSION_RETENTION_DAYS=90
+# to purge sessions idle for 90 days with their messages, vault maps and files.
+SESSION_RETENTION_DAYS = float(os.getenv("SESSION_RETENTION_DAYS", "0"))
+MESSAGE_RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "0"))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "3600"))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "200"))
+ORPHAN_GRACE_SECONDS = float(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))
+MAX_BATCHES_PER_SWEEP = 50   # bounds one sweep; the rest waits for the next one
+LEASE_ID = "lifecycle_sweeper"
+
+
+class LifecycleSweeper:
+    """
+    Background retention and garbage collection for session data.
+    - DELETE /sessions/{sid} only marks the session (`deleted_at`); the
+      sweeper is woken and purges it with its messages, vault maps and
+      GridFS blob. The mark is durable, so a restart mid-purge just resumes.
+    - Sessions idle (updated_at, else created_at) longer than
+      SESSION_RETENTION_DAYS are purged the same way, in batches.
+    - With MESSAGE_RETENTION_DAYS, older messages of live sessions are trimmed.
+    - Orphaned fs.chunks / fs.files (failed deletes, interrupted uploads)
+      are reconciled on every sweep.
+    Timestamps are ISO strings, so cutoffs compare as strings (no TTL index).
+    Every uvicorn worker starts a sweeper, but full sweeps only run in the one
+    holding the lease doc in `locks` (renewed each sweep, taken over once it
+    expires after two intervals). Delete wake-ups purge in whichever worker
+    served the delete: they only touch marked sessions and are idempotent.
+    `on_purge(session_ids)` lets the server drop in-memory state.
+    """
+    def __init__(self, db, file_store, vault_store=None, on_purge=None, interval: float = None, batch_size: int = None,
+                 session_days: float = None, message_days: float = None, grace_seconds: float = None):
+        self.db = db
+        self.file_store = file_store
+        self.vault_store = vault_store
+        self.on_purge = on_purge
+        self.interval = interval or SWEEP_INTERVAL_SECONDS
+        self.batch_size = batch_size or SWEEP_BATCH_SIZE
+        self.session_days = SESSION_RETENTION_DAYS if session_days is None else session_days
+        self.message_days = MESSAGE_RETENTION_DAYS if message_days is None else message_days
+        self.grace_seconds = ORPHAN_GRACE_SECONDS if grace_seconds is None else grace_seconds
+        self._task = None
+        self._wake = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.sweeps = 0
+        self.last_sweep = None
+        self.totals = {"deleted_sessions": 0, "expired_sessions": 0, "messages": 0, "orphan_chunks": 0, "orphan_files": 0, "blob_failures": 0}
+
+    # --- Lifecycle ---
+    def start(self):
+        if self.db is None or self._task is not None: return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None: return
+        self._task.cancel()
+        try: await self._task
+        except asyncio.CancelledError: pass
+        self._task = None
+        try:   # hand the lease over now instead of after it expires
+            await asyncio.to_thread(self.db.locks.delete_one, {"_id": LEASE_ID, "owner": self.owner})
+        except Exception as e:
+            print(f"⚠️ [LIFECYCLE] Lease release failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+                deletes_only = True   # woken by a delete: don't run the full sweep each time
+            except asyncio.TimeoutError:
+                deletes_only = False
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.sweep, deletes_only)
+            except Exception as e:
+                print(f"⚠️ [LIFECYCLE] Sweep failed: {e}")
+
+    # --- Request path ---
+    def mark_deleted(self, session_id: str):
+        """Hides the session from listings and queues its purge. Upserts, so dependents of a missing session doc still get purged."""
+        self.db.sessions.update_one(
+            {"session_id": session_id},
+            {"$set": {"deleted_at": datetime.now().isoformat()}},
+            upsert=True
+        )
+        if self._wake is not None: self._wake.set()
+
+    # --- Lease ---
+    def _acquire_lease(self):
+        """Takes or renews the sweep lease; False while another worker holds an unexpired one."""
+        now = datetime.now()
+        try:
+            self.db.locks.find_one_and_update(
+                {"_id": LEASE_ID, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now.isoformat()}}]},
+                {"$set": {"owner": self.owner, "expires_at": (now + timedelta(seconds=self.interval * 2)).isoformat()}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:   # the doc exists and the filter didn't match: held elsewhere
+            return False
+
+    # --- Sweep ---
+    def sweep(self, deletes_only: bool = False):
+        """One pass; blocking (runs in a worker thread). Returns this pass's counts, None without the lease."""
+        if self.db is None: return {}
+        if not deletes_only and not self._acquire_lease(): return None
+        started = time.monotonic()
+        counts = dict.fromkeys(self.totals, 0)
+        counts["deleted_sessions"] = self._purge_matching({"deleted_at": {"$exists": True}}, counts)
+
+        if not deletes_only:
+            if self.session_days > 0:
+                cutoff = self._cutoff(self.session_days)
+                expired = {"deleted_at": {"$exists": False}, "$or": [
+                    {"updated_at": {"$lt": cutoff}},
+                    {"updated_at": None, "created_at": {"$lt": cutoff}},
+                ]}
+                counts["expired_sessions"] = self._purge_matching(expired, counts)
+            if self.message_days > 0:
+                counts["messages"] += self._delete_in_batches(self.db.messages, {"timestamp": {"$lt": self._cutoff(self.message_days)}})
+            counts["orphan_chunks"], counts["orphan_files"] = self.file_store.reconcile_orphans(self.grace_seconds, self.batch_size)
+
+        for k, v in counts.items(): self.totals[k] += v
+        self.sweeps += 1
+        self.last_sweep = datetime.now().isoformat()
+        if any(counts.values()):
+            summary = ", ".join(f"{k} {v}" for k, v in counts.items() if v)
+            print(f"🧹 [LIFECYCLE] {summary} in {time.monotonic() - started:.1f}s")
+        return counts
+
+    @staticmethod
+    def _cutoff(days: float):
+        return (datetime.now() - timedelta(days=days)).isoformat()
+
+    def _purge_matching(self, query: dict, counts: dict):
+        purged = 0
+        for _ in range(MAX_BATCHES_PER_SWEEP):
+            sids = [d["session_id"] for d in self.db.sessions.find(query, {"_id": 0, "session_id": 1}).limit(self.batch_size)]
+            if not sids: break
+            self._purge(sids, counts)
+            purged += len(sids)
+            if len(sids) < self.batch_size: break
+        return purged
+
+    def _purge(self, session_ids, counts: dict):
+        """Dependents first, the session docs last: an interrupted purge is retried next sweep."""
+        counts["messages"] += self.db.messages.delete_many({"session_id": {"$in": session_ids}}).deleted_count
+        if self.vault_store is not None:
+            self.vault_store.delete_many(session_ids)
+        counts["blob_failures"] += self.file_store.delete_files(session_ids)
+        self.db.sessions.delete_many({"session_id": {"$in": session_ids}})
+        if self.on_purge:
+            self.on_purge(session_ids)
+
+    def _delete_in_batches(self, collection, query: dict):
+        deleted = 0
+        for _ in range(MAX_BATCHES_PER_SWEEP):
+            ids = [d["_id"] for d in collection.find(query, {"_id": 1}).limit(self.batch_size)]
+            if not ids: break
+            deleted += collection.delete_many({"_id": {"$in": ids}}).deleted_count
+            if len(ids) < self.batch_size: break
+        return deleted
+
+    def stats(self):
+        return {
+            "owner": self.owner,
+            "session_retention_days": self.session_days,
+            "message_retention_days": self.message_days,
+            "sweeps": self.sweeps,
+            "last_sweep": self.last_sweep,
+            **self.totals,
+        }
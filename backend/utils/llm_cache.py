@@ -0,0 +1,101 @@
+# backend/utils/llm_cache.py
+import time
+import textwrap
+import sqlite3
+import hashlib
+import asyncio
+import threading
+
+from utils.lru_cache import LRUCache
+
+
+class PromptCache:
+    """
+    Content-addressed cache in front of the model rotator.
+    Key = sha256(model family + JSON mode + normalized prompt).
+    Tier 1: in-memory LRU with TTL. Tier 2 (optional): SQLite file that survives restarts.
+    """
+    def __init__(self, max_entries: int = 2048, ttl: float = 3600, db_path: str = None):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.disk_hits = 0
+        self.writes = 0
+
+        if db_path:
+            try:
+                self._conn = sqlite3.connect(db_path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                self._conn.commit()
+                print(f"✅ [LLM CACHE] Disk tier at {db_path}")
+            except Exception as e:
+                print(f"⚠️ [LLM CACHE] Disk tier disabled: {e}")
+                self._conn = None
+
+    @staticmethod
+    def make_key(prompt: str, json_mode: bool, family: str):
+        # Prompts are built from indented f-strings: drop the template's common
+        # indentation and trailing spaces only. Whitespace inside lines (user
+        # data, code, document text) is significant and stays in the key.
+        normalized = "\n".join(line.rstrip() for line in textwrap.dedent(prompt).strip().splitlines())
+        raw = f"{family}|{'json' if json_mode else 'text'}|{normalized}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None or self._conn is None:
+            return value
+
+        value = await asyncio.to_thread(self._disk_get, key)
+        if value is not None:
+            self.disk_hits += 1
+            self.memory.set(key, value)   # promote
+        return value
+
+    async def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        self.writes += 1
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_set, key, value)
+
+    def _disk_get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            if time.time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row[0]
+
+    def _disk_set(self, key: str, value: str):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, value, time.time())
+                )
+                self._conn.commit()
+        except Exception as e:
+            print(f"⚠️ [LLM CACHE] Disk write failed: {e}")
+
+    def stats(self):
+        mem = self.memory.stats()
+        hits = mem["hits"] + self.disk_hits
+        # A disk hit is also counted as a memory miss; report true misses only
+        misses = mem["misses"] - self.disk_hits
+        total = hits + misses
+        return {
+            "memory_hits": mem["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "writes": self.writes,
+            "memory_entries": mem["entries"],
+            "disk_enabled": self._conn is not None,
+        }
@@ -1,44 +1,375 @@
 import pandas as pd
 import io
+import os
+import sys
+import queue
+import tempfile
 import logging
+import subprocess
+import multiprocessing
+from multiprocessing.connection import Connection
+from concurrent.futures import ThreadPoolExecutor
 # You need to install these: pip install pypdf openpyxl pyarrow
 from pypdf import PdfReader 
 
-def load_file_universally(filename: str, file_bytes: bytes):
+# Streaming upload limits
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(2 * 1024 ** 3)))
+# Rows per parsed chunk for CSV uploads
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "250000"))
+
+# Formats that can be parsed and tokenized chunk by chunk
+CHUNKABLE_EXTENSIONS = ('.csv', '.parquet')
+
+
+async def spool_upload(upload, max_bytes: int = MAX_UPLOAD_BYTES):
+    """
+    Streams an UploadFile to a temp file in 1MB chunks, enforcing `max_bytes`
+    as soon as it is crossed (or up front when the size is known).
+    Returns the temp file path; the caller removes it.
+    """
+    size = getattr(upload, "size", None)
+    if size is not None and size > max_bytes:
+        raise ValueError(f"File too large ({size} bytes, limit {max_bytes})")
+
+    suffix = os.path.splitext(upload.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="nexus_upload_", suffix=suffix)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+                if not chunk: break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(f"File too large (over {max_bytes} bytes)")
+                out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+# =========================================================
+# 🟢 COMPACT MODE (memory-optimized dtypes)
+# =========================================================
+COMPACT_DEFAULT = os.getenv("LOADER_COMPACT_MODE", "0").lower() in ("1", "true", "yes")
+# Share of distinct values under which a string column becomes `category`
+CATEGORY_RATIO = 0.5
+DATE_PATTERN = r"^\s*(\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4})([ T]\d{1,2}:\d{2}(:\d{2})?.*)?\s*$"
+
+try:
+    import pyarrow  # noqa: F401
+    ARROW_STRING = "string[pyarrow]"
+except ImportError:
+    ARROW_STRING = None
+
+
+def column_bytes(df: pd.DataFrame):
+    """Deep memory usage per column, in bytes."""
+    return {str(c): int(v) for c, v in df.memory_usage(deep=True, index=False).items()}
+
+
+def _looks_like_dates(s: pd.Series):
+    sample = s.dropna()
+    if sample.empty: return False
+    sample = sample.sample(min(len(sample), 500), random_state=0).astype(str)
+    return sample.str.match(DATE_PATTERN).mean() >= 0.95
+
+
+def _compact_numeric(s: pd.Series):
+    if pd.api.types.is_bool_dtype(s): return s
+    if pd.api.types.is_integer_dtype(s):
+        return pd.to_numeric(s, downcast="integer")
+    if pd.api.types.is_float_dtype(s):
+        small = pd.to_numeric(s, downcast="float")
+        # Only keep float32 when it is lossless: analytics must not drift
+        if small.dtype != s.dtype and ((small.astype(s.dtype) == s) | s.isna()).all():
+            return small
+    return s
+
+
+def compact_dataframe(df: pd.DataFrame, numeric: bool = True, dates: bool = True, strings: bool = True):
+    """
+    "Compact" loading mode. Returns a frame with smaller dtypes:
+    - numeric: integers downcast, floats to float32 only when lossless
+    - dates: object columns that are clearly dates -> datetime64
+    - strings: low-cardinality text -> category, the rest -> Arrow-backed strings
+    Run it on the whole frame after the vault: decisions are then made once
+    per file (chunks can't disagree), and tokenized columns no longer look
+    like dates, so values the vault hides (e.g. birth dates) stay tokens.
+    """
+    out = df.copy(deep=False)
+    for col in df.columns:
+        s = df[col]
+        new = s
+        if numeric and pd.api.types.is_numeric_dtype(s):
+            new = _compact_numeric(s)
+        elif dates and s.dtype == object and _looks_like_dates(s):
+            parsed = pd.to_datetime(s, errors="coerce")
+            # Don't silently turn real values into NaT
+            if parsed.notna().sum() >= 0.95 * s.notna().sum():
+                new = parsed
+        if strings and (new.dtype == object or pd.api.types.is_string_dtype(new)) and not isinstance(new.dtype, pd.CategoricalDtype):
+            n = len(new)
+            if n and new.nunique(dropna=True) <= CATEGORY_RATIO * n:
+                new = new.astype("category")
+            elif ARROW_STRING and pd.api.types.infer_dtype(new, skipna=True) == "string":
+                new = new.astype(ARROW_STRING)
+        if new is not s:
+            out[col] = new
+    return out
+
+
+def memory_report(before: dict, df: pd.DataFrame):
+    """Per-column memory before/after compaction, plus totals, for the session record."""
+    after = column_bytes(df)
+    columns = {
+        c: {"before": before.get(c, after[c]), "after": after[c], "dtype": str(df[c].dtype) if c in df else None}
+        for c in after
+    }
+    total_before = sum(v["before"] for v in columns.values())
+    total_after = sum(v["after"] for v in columns.values())
+    return {
+        "columns": columns,
+        "total_before": total_before,
+        "total_after": total_after,
+        "ratio": round(total_before / total_after, 2) if total_after else None,
+    }
+
+
+def iter_measured(chunks, before: dict):
+    """Passes chunks through, accumulating their raw per-column sizes into `before` (for memory_report)."""
+    for chunk in chunks:
+        for c, b in column_bytes(chunk).items():
+            before[c] = before.get(c, 0) + b
+        yield chunk
+
+
+# =========================================================
+# 🟢 PARALLEL PDF EXTRACTION
+# =========================================================
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = 16
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_pdf_pool = None
+
+
+class _PdfWorker:
+    """
+    One warm extraction process: a fresh `python -m utils.loaders` on an
+    inherited pipe (like the exec engine's workers), so it never re-imports
+    the server's main module the way multiprocessing's spawn would.
+    """
+    def __init__(self):
+        parent, child = multiprocessing.Pipe()
+        fd = child.fileno()
+        self.proc = subprocess.Popen([sys.executable, "-m", "utils.loaders", str(fd)], cwd=BACKEND_DIR, pass_fds=(fd,))
+        child.close()
+        self.conn = parent
+
+    def run(self, path: str, start: int, stop: int):
+        self.conn.send((path, start, stop))
+        ok, value = self.conn.recv()
+        if not ok: raise RuntimeError(value)
+        return value
+
+    def kill(self):
+        if self.proc.poll() is None: self.proc.kill()
+        self.proc.wait(timeout=5)
+        self.conn.close()
+
+
+class _PdfPool:
+    """Page-range tasks fanned out over PDF_WORKERS warm processes; submit() returns a Future."""
+    def __init__(self, workers: int):
+        self._idle = queue.Queue()
+        for _ in range(workers): self._idle.put(_PdfWorker())
+        self._threads = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, path: str, start: int, stop: int):
+        return self._threads.submit(self._run, path, start, stop)
+
+    def _run(self, path: str, start: int, stop: int):
+        worker = self._idle.get()
+        try:
+            return worker.run(path, start, stop)
+        except (EOFError, OSError):
+            worker.kill()   # died mid-task: replace it
+            worker = _PdfWorker()
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+
+
+def _get_pdf_pool():
+    # One warm pool per process, created on first large PDF (POSIX: workers inherit a pipe fd)
+    global _pdf_pool
+    if _pdf_pool is None:
+        _pdf_pool = _PdfPool(PDF_WORKERS)
+    return _pdf_pool
+
+
+def shutdown_pdf_pool():
+    """Stops the PDF worker pool (app shutdown)."""
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown()
+        _pdf_pool = None
+
+
+def _extract_page_range(path: str, start: int, stop: int):
+    """Worker task: each page's text, extracted exactly once."""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def iter_pdf_pages(file_data):
+    """
+    Yields (page_number, text) in page order, streaming each batch of pages
+    as soon as it (and every batch before it) is decoded. Spooled files fan
+    out over a process pool; small PDFs and raw bytes are read serially.
+    """
+    if isinstance(file_data, (bytes, bytearray)):
+        reader = PdfReader(io.BytesIO(file_data))
+        for i, page in enumerate(reader.pages):
+            yield i + 1, page.extract_text() or ""
+        return
+
+    n_pages = len(PdfReader(file_data).pages)
+    if PDF_WORKERS <= 1 or n_pages <= PDF_PAGES_PER_TASK or os.name != "posix":
+        for i, text in enumerate(_extract_page_range(file_data, 0, n_pages)):
+            yield i + 1, text
+        return
+
+    pool = _get_pdf_pool()
+    futures = [
+        (start, pool.submit(file_data, start, min(start + PDF_PAGES_PER_TASK, n_pages)))
+        for start in range(0, n_pages, PDF_PAGES_PER_TASK)
+    ]
+    for start, fut in futures:
+        for offset, text in enumerate(fut.result()):
+            yield start + offset + 1, text
+
+
+def extract_pdf(file_data, meta: dict = None):
+    """
+    Full document text (non-empty pages joined by newlines, as before).
+    Records per-page character offsets in meta["page_offsets"] for later lookup.
+    """
+    parts, offsets, pos = [], [], 0
+    for page_no, text in iter_pdf_pages(file_data):
+        if not text: continue
+        if parts: pos += 1   # the "\n" separator
+        offsets.append({"page": page_no, "start": pos, "end": pos + len(text)})
+        parts.append(text)
+        pos += len(text)
+    if meta is not None:
+        meta["page_offsets"] = offsets
+    return "\n".join(parts)
+
+
+def _as_source(file_data):
+    # Accept raw bytes (legacy callers) or a path to a spooled file
+    return io.BytesIO(file_data) if isinstance(file_data, (bytes, bytearray)) else file_data
+
+
+def is_chunkable(filename: str):
+    return filename.lower().endswith(CHUNKABLE_EXTENSIONS)
+
+
+def iter_structured_chunks(filename: str, file_data, chunk_rows: int = CSV_CHUNK_ROWS):
+    """
+    Yields DataFrame chunks without materializing the whole file:
+    CSV in `chunk_rows` row chunks, Parquet one row group at a time.
+    A file without rows yields one empty frame carrying its columns.
+    """
+    filename = filename.lower()
+    source = _as_source(file_data)
+
+    if filename.endswith('.csv'):
+        empty = True
+        with pd.read_csv(source, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                empty = False
+                yield chunk
+        if empty:
+            # Header-only file: an empty frame with its columns, as the single-shot path returns
+            if hasattr(source, "seek"): source.seek(0)
+            yield pd.read_csv(source, nrows=0)
+
+    elif filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(source)
+        for i in range(pf.num_row_groups):
+            yield pf.read_row_group(i).to_pandas()
+        if pf.num_row_groups == 0:
+            yield pf.schema_arrow.empty_table().to_pandas()
+
+    else:
+        raise ValueError(f"Chunked parsing not supported for {filename}")
+
+
+def load_file_universally(filename: str, file_bytes, meta: dict = None):
     """
     Universal File Ingestion:
     - CSV/JSON/Excel/Parquet -> Returns (Pandas DataFrame, "structured")
     - PDF/TXT/MD -> Returns (String Text, "unstructured")
+    `file_bytes` may be the raw bytes or a path to a spooled upload.
+    If `meta` is given, loader side data (e.g. PDF page offsets) is stored in it.
     """
     filename = filename.lower()
     
     try:
         # 1. Structured Data (Rows & Columns)
         if filename.endswith('.csv'):
-            return pd.read_csv(io.BytesIO(file_bytes)), "structured"
+            return pd.read_csv(_as_source(file_bytes)), "structured"
             
         elif filename.endswith('.json'):
-            return pd.read_json(io.BytesIO(file_bytes)), "structured"
+            return pd.read_json(_as_source(file_bytes)), "structured"
             
         elif filename.endswith('.xlsx') or filename.endswith('.xls'):
-            return pd.read_excel(io.BytesIO(file_bytes)), "structured"
+            return pd.read_excel(_as_source(file_bytes)), "structured"
 
         elif filename.endswith('.parquet'):
-            return pd.read_parquet(io.BytesIO(file_bytes)), "structured"
+            return pd.read_parquet(_as_source(file_bytes)), "structured"
 
         # 2. Unstructured Data (Documents)
         elif filename.endswith('.pdf'):
-            # Extract text from PDF
-            reader = PdfReader(io.BytesIO(file_bytes))
-            text = "\n".join([page.extract_text() for page in reader.pages if page.extract_text()])
-            return text, "unstructured"
+            # Extract text from PDF (each page once, pages fanned out to a process pool)
+            return extract_pdf(file_bytes, meta), "unstructured"
 
         elif filename.endswith('.txt') or filename.endswith('.md'):
-            return file_bytes.decode('utf-8', errors='ignore'), "unstructured"
+            if isinstance(file_bytes, (bytes, bytearray)):
+                return file_bytes.decode('utf-8', errors='ignore'), "unstructured"
+            with open(file_bytes, 'r', encoding='utf-8', errors='ignore') as f:
+                return f.read(), "unstructured"
 
         else:
             return None, "unsupported"
 
     except Exception as e:
         print(f"❌ Loader Failed: {e}")
-        return None, "error"
\ No newline at end of file
+        return None, "error"
+
+
+def _pdf_worker_main(conn):
+    while True:
+        try:
+            path, start, stop = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            conn.send((True, _extract_page_range(path, start, stop)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+if __name__ == "__main__":
+    # PDF worker entry point: python -m utils.loaders <pipe fd>
+    _pdf_worker_main(Connection(int(sys.argv[1])))
@@ -0,0 +1,104 @@
+# backend/utils/lru_cache.py
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU used by the in-process caches.
+    - Bounded by entry count and/or bytes (via a `sizeof(value)` callback).
+    - Optional TTL per entry.
+    - `on_evict(key, value)` fires for capacity evictions (not for pop/expiry),
+      so callers can spill evicted values somewhere cheaper.
+    """
+    def __init__(self, max_entries: int = None, max_bytes: int = None, ttl: float = None, sizeof=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda v: 0)
+        self.on_evict = on_evict
+        self._data = OrderedDict()   # key -> (value, size, stored_at)
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at: float):
+        return self.ttl is not None and time.monotonic() - stored_at > self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[2]):
+                if item is not None: self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key, default=None):
+        """Like get() but without touching recency or hit counters."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[2]): return default
+            return item[0]
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        evicted = []
+        with self._lock:
+            if key in self._data: self._remove(key)
+            self._data[key] = (value, size, time.monotonic())
+            self.bytes += size
+            while len(self._data) > 1 and self._over_capacity():
+                old_key, (old_value, _, _) = next(iter(self._data.items()))
+                self._remove(old_key)
+                self.evictions += 1
+                evicted.append((old_key, old_value))
+        # Callbacks run outside the lock: spilling can be slow (disk writes)
+        if self.on_evict:
+            for k, v in evicted: self.on_evict(k, v)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data: return default
+            value = self._data[key][0]
+            self._remove(key)
+            return value
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def _over_capacity(self):
+        if self.max_entries is not None and len(self._data) > self.max_entries: return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
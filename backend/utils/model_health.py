@@ -0,0 +1,207 @@
+# backend/utils/model_health.py
+import os
+import time
+from collections import deque
+
+# How long a model stays marked unsupported (404, no JSON mode) before it is tried again
+UNSUPPORTED_TTL = float(os.getenv("LLM_UNSUPPORTED_TTL", "3600"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ModelHealth:
+    """Rolling stats + circuit breaker state for a single model."""
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self.latencies = deque(maxlen=window)   # seconds, successful calls only
+        self.outcomes = deque(maxlen=window)    # True = success, False = failure
+        self.calls = 0
+        self.successes = 0
+        self.quota_errors = 0
+        self.not_found_errors = 0
+        self.invalid_request_errors = 0         # 400s caused by the prompt, not the model
+        self.other_errors = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.probe_in_flight = False
+        self.unsupported = {}                   # "all" / "json" -> monotonic time the mark expires
+        self.last_error = None
+
+    @property
+    def error_rate(self):
+        if not self.outcomes: return 0.0
+        return 1 - (sum(self.outcomes) / len(self.outcomes))
+
+    @property
+    def avg_latency(self):
+        if not self.latencies: return None
+        return sum(self.latencies) / len(self.latencies)
+
+    def marked(self, kind: str, now: float = None):
+        until = self.unsupported.get(kind)
+        if until is None: return False
+        if (now or time.monotonic()) >= until:
+            del self.unsupported[kind]   # expired: worth another try
+            return False
+        return True
+
+    def supports(self, json_mode: bool, now: float = None):
+        if self.marked("all", now): return False
+        return not (json_mode and self.marked("json", now))
+
+
+class ModelScoreboard:
+    """
+    Process-wide health board for the model rotator.
+    - Tracks rolling latency, error rate and 429/404 outcomes per model.
+    - Trips a circuit breaker after repeated failures; after a cooldown one
+      half-open probe is let through, success closes it, failure re-opens
+      it with a doubled cooldown.
+    - Remembers models that can't serve a call (404, no JSON mode) for
+      UNSUPPORTED_TTL seconds, then tries them again.
+    - 400 / INVALID_ARGUMENT errors are the prompt's fault, not the model's:
+      counted, but kept out of the error rate and the breaker.
+    """
+    def __init__(self, window: int = 20, failure_threshold: int = 3, error_rate_threshold: float = 0.5,
+                 cooldown: float = 30.0, max_cooldown: float = 300.0, unsupported_ttl: float = None):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.unsupported_ttl = UNSUPPORTED_TTL if unsupported_ttl is None else unsupported_ttl
+        self.models = {}
+
+    def _get(self, model: str):
+        if model not in self.models:
+            self.models[model] = ModelHealth(model, self.window)
+        return self.models[model]
+
+    def _skip_reason(self, h: ModelHealth, json_mode: bool, now: float):
+        if not h.supports(json_mode, now):
+            return "unsupported (not found)" if "all" in h.unsupported else "unsupported (json mode)"
+        if h.state == OPEN and now - h.opened_at < h.cooldown:
+            return f"circuit open ({h.cooldown - (now - h.opened_at):.0f}s left)"
+        if h.state == HALF_OPEN and h.probe_in_flight:
+            return "half-open probe in flight"
+        return None
+
+    def rank(self, models, json_mode: bool = False):
+        """
+        Returns the models worth calling, fastest healthy first.
+        Measured healthy models are ordered by latency penalised by error rate,
+        then untried ones in their configured priority, then half-open probes.
+        """
+        now = time.monotonic()
+        ranked = []
+        for priority, m in enumerate(models):
+            h = self._get(m)
+            if self._skip_reason(h, json_mode, now): continue
+
+            if h.state == CLOSED and h.avg_latency is not None:
+                ranked.append(((0, h.avg_latency * (1 + 4 * h.error_rate), priority), m))
+            elif h.state == CLOSED:
+                ranked.append(((1, 0, priority), m))
+            else:
+                ranked.append(((2, 0, priority), m))
+        return [m for _, m in sorted(ranked)]
+
+    def allow(self, model: str, json_mode: bool = False):
+        """Re-check right before calling: another request may have taken the half-open probe."""
+        return self._skip_reason(self._get(model), json_mode, time.monotonic()) is None
+
+    def begin(self, model: str):
+        """Called right before a call; moves a cooled-down open breaker to half-open."""
+        h = self._get(model)
+        h.calls += 1
+        if h.state == OPEN and time.monotonic() - h.opened_at >= h.cooldown:
+            h.state = HALF_OPEN
+        if h.state == HALF_OPEN:
+            h.probe_in_flight = True
+
+    def record_success(self, model: str, latency: float):
+        h = self._get(model)
+        h.successes += 1
+        h.latencies.append(latency)
+        h.outcomes.append(True)
+        h.consecutive_failures = 0
+        h.probe_in_flight = False
+        if h.state != CLOSED:
+            print(f"🟢 [ROUTER] {model} recovered, closing circuit.")
+        h.state = CLOSED
+        h.cooldown = 0.0
+
+    def record_failure(self, model: str, error: Exception):
+        h = self._get(model)
+        err_str = str(error)
+        h.last_error = err_str[:200]
+        h.probe_in_flight = False
+        if "400" in err_str or "INVALID_ARGUMENT" in err_str:
+            # A bad prompt fails on every model: don't let it trip their breakers
+            h.invalid_request_errors += 1
+            return
+        h.outcomes.append(False)
+        h.consecutive_failures += 1
+
+        if "429" in err_str or "Quota" in err_str or "RESOURCE" in err_str:
+            h.quota_errors += 1
+        elif "404" in err_str or "NOT_FOUND" in err_str:
+            h.not_found_errors += 1
+            h.unsupported["all"] = time.monotonic() + self.unsupported_ttl
+        else:
+            h.other_errors += 1
+
+        tripped = h.consecutive_failures >= self.failure_threshold or (
+            len(h.outcomes) >= 5 and h.error_rate >= self.error_rate_threshold
+        )
+        if h.state == HALF_OPEN or (h.state == CLOSED and tripped):
+            self._open(h)
+
+    def record_cancelled(self, model: str):
+        """
+        A hedge loser (or abandoned stream) was cancelled: no verdict and no
+        latency sample (a cut-short time would skew the hedging percentile);
+        just release any half-open probe.
+        """
+        self._get(model).probe_in_flight = False
+
+    def latency_percentile(self, model: str, p: float, min_samples: int = 5):
+        """Rolling latency percentile for hedging decisions; None until enough samples exist."""
+        samples = sorted(self._get(model).latencies)
+        if len(samples) < min_samples: return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def mark_unsupported(self, model: str, json_mode: bool):
+        """Remember that a model rejects this kind of call (e.g. JSON mode on Gemma)."""
+        self._get(model).unsupported["json" if json_mode else "all"] = time.monotonic() + self.unsupported_ttl
+
+    def _open(self, h: ModelHealth):
+        h.cooldown = min(self.max_cooldown, h.cooldown * 2 if h.cooldown else self.base_cooldown)
+        h.state = OPEN
+        h.opened_at = time.monotonic()
+        print(f"🔴 [ROUTER] Circuit open for {h.name} ({h.cooldown:.0f}s). Last error: {h.last_error}")
+
+    def snapshot(self, json_mode: bool = False):
+        """Inspectable view of every model, including why it would be skipped right now."""
+        now = time.monotonic()
+        out = {}
+        for m, h in self.models.items():
+            out[m] = {
+                "state": h.state,
+                "calls": h.calls,
+                "successes": h.successes,
+                "quota_errors": h.quota_errors,
+                "not_found_errors": h.not_found_errors,
+                "invalid_request_errors": h.invalid_request_errors,
+                "other_errors": h.other_errors,
+                "error_rate": round(h.error_rate, 3),
+                "avg_latency_s": round(h.avg_latency, 3) if h.avg_latency is not None else None,
+                "unsupported": sorted(h.unsupported),
+                "skip_reason": self._skip_reason(h, json_mode, now),
+                "last_error": h.last_error,
+            }
+        return out
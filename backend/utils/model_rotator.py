@@ -0,0 +1,334 @@
+# backend/utils/model_rotator.py
+import os
+import time
+import asyncio
+
+from utils.model_health import ModelScoreboard
+from utils.llm_cache import PromptCache
+from utils.prompt_budget import PROMPT_TOKEN_BUDGET, estimate_tokens, input_limit
+
+# Priority Queue based on Speed > Intelligence > Experimental
+DEFAULT_MODELS = [
+    'gemini-2.0-flash',
+    'gemini-2.5-flash',
+    'gemini-1.5-flash',
+    'gemini-flash-latest',
+    'gemini-2.0-flash-lite-preview-02-05', # Very fast backup
+
+    # Smart Models (Slower, stricter quota)
+    'gemini-1.5-pro',
+    'gemini-pro-latest',
+
+    # Experimental / New
+    'gemini-2.0-flash-exp',
+    'gemini-exp-1206',
+    'gemini-2.0-flash-001',
+
+    # Open Models (Note: These DO NOT support JSON mode config)
+    'gemma-3-27b-it',
+    'gemma-3-4b-it'
+]
+
+# Errors that mean "this model can't serve us right now, try the next one"
+# 400 is included to catch the Gemma JSON-mode error if it slips through
+# (the scoreboard doesn't count 400s against the model's health)
+SKIPPABLE_ERRORS = ["429", "404", "RESOURCE", "NOT_FOUND", "Quota", "busy", "exhausted", "400", "INVALID_ARGUMENT"]
+
+FAILURE_MESSAGE = "Error: System Overloaded. All AI models are currently busy. Please try again."
+_STREAM_END = object()
+
+
+class ModelRotator:
+    """
+    Async model rotator built on the SDK's `client.aio` surface.
+    A semaphore bounds how many LLM calls are in flight per process, and a
+    shared ModelScoreboard decides the routing order and which models to skip.
+    An optional PromptCache short-circuits repeated prompts.
+    """
+    def __init__(self, genai_client, models=None, max_concurrency: int = None, scoreboard: ModelScoreboard = None,
+                 cache: PromptCache = None, model_family: str = None):
+        self.client = genai_client
+        self.models = list(models or DEFAULT_MODELS)
+        self.model_family = model_family or os.getenv("LLM_MODEL_FAMILY", "gemini")
+        self.cache = cache
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+        self.scoreboard = scoreboard or ModelScoreboard(
+            cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+        )
+        self._semaphore = None
+
+        # Hedged (speculative) requests, opt-in
+        self.hedging = os.getenv("LLM_HEDGING", "0").lower() in ("1", "true", "yes")
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+        self.hedge_budget = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+        self.hedge_default_delay = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8"))
+        self.hedge_burst = 5.0
+        self._hedge_tokens = 0.0
+        self.hedge_stats = {"fired": 0, "won": 0, "over_budget": 0, "replaced": 0}
+
+    @property
+    def semaphore(self):
+        # Created lazily so it binds to the running event loop (uvicorn's), not import time.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _config_for(self, model: str, json_mode: bool):
+        # 🔴 CRITICAL FIX: Gemma models do not support response_mime_type
+        # We must disable JSON mode enforcement for them, even if requested.
+        if json_mode and "gemma" not in model:
+            return {'response_mime_type': 'application/json'}
+        return None
+
+    async def _call(self, model: str, prompt: str, json_mode: bool):
+        async with self.semaphore:
+            response = await self.client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=self._config_for(model, json_mode)
+            )
+        return response.text
+
+    async def _attempt(self, model: str, prompt: str, json_mode: bool):
+        """One scored call: records the outcome on the scoreboard and re-raises failures."""
+        self.scoreboard.begin(model)
+        started = time.monotonic()
+        try:
+            text = await self._call(model, prompt, json_mode)
+        except asyncio.CancelledError:
+            # Lost a hedge race: not the model's fault, just release any half-open probe
+            self.scoreboard.record_cancelled(model)
+            raise
+        except Exception as e:
+            err_str = str(e)
+            # JSON mode rejected: remember it instead of paying for it on every request
+            if json_mode and self._config_for(model, json_mode) and ("json" in err_str.lower() or "mime" in err_str.lower()):
+                self.scoreboard.mark_unsupported(model, json_mode=True)
+            self.scoreboard.record_failure(model, e)
+
+            # Filter for API errors (Quota, Not Found, Overloaded); anything else is worth a log line
+            if not any(x in err_str for x in SKIPPABLE_ERRORS):
+                print(f"⚠️ Error on {model}: {err_str}")
+            raise
+        self.scoreboard.record_success(model, time.monotonic() - started)
+        return text
+
+    def _next_model(self, candidates, json_mode: bool):
+        # Another request may have tripped the breaker or taken the probe meanwhile
+        for m in candidates:
+            if self.scoreboard.allow(m, json_mode):
+                return m
+        return None
+
+    async def generate(self, prompt: str, json_mode: bool = False, hedge: bool = False, use_cache: bool = True):
+        """
+        Calls models in scoreboard order (fastest healthy first) until one answers.
+        With `hedge=True` (and LLM_HEDGING enabled) a slow primary is raced against
+        the next candidate; see `_generate_hedged`.
+        Answers are served from / stored in the prompt cache unless `use_cache=False`.
+        Returns the response text, or FAILURE_MESSAGE if every model failed.
+        """
+        key = None
+        if self.cache is not None and use_cache:
+            key = self.cache.make_key(prompt, json_mode, self.model_family)
+            cached = await self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        text = await self._route(prompt, json_mode, hedge)
+
+        # Never cache failures, the next caller deserves a fresh attempt
+        if key is not None and text and text != FAILURE_MESSAGE:
+            await self.cache.set(key, text)
+        return text
+
+    async def generate_stream(self, prompt: str, use_cache: bool = True):
+        """
+        Streaming variant of `generate` (text mode): yields chunks as the model
+        produces them. Fails over to the next model only until the first chunk
+        has been yielded; a failure after that ends the stream with the error.
+        Cache hits come back as a single chunk; full answers are cached.
+        """
+        key = None
+        if self.cache is not None and use_cache:
+            key = self.cache.make_key(prompt, False, self.model_family)
+            cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        candidates = iter(self._ranked_for(prompt, False))
+        last_err = None
+        while True:
+            m = self._next_model(candidates, False)
+            if m is None: break
+
+            parts = []
+            self.scoreboard.begin(m)
+            started = time.monotonic()
+            queue = asyncio.Queue()
+            pump = asyncio.create_task(self._pump_stream(m, prompt, queue))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _STREAM_END: break
+                    if isinstance(item, Exception): raise item
+                    parts.append(item)
+                    yield item
+            except (asyncio.CancelledError, GeneratorExit):
+                # Client went away mid-stream: not the model's fault
+                pump.cancel()
+                self.scoreboard.record_cancelled(m)
+                raise
+            except Exception as e:
+                self.scoreboard.record_failure(m, e)
+                if parts: raise   # already streaming: can't switch models mid-answer
+                if not any(x in str(e) for x in SKIPPABLE_ERRORS):
+                    print(f"⚠️ Error on {m}: {e}")
+                last_err = e
+                continue
+            self.scoreboard.record_success(m, time.monotonic() - started)
+
+            text = "".join(parts)
+            if key is not None and text:
+                await self.cache.set(key, text)
+            return
+
+        print(f"❌ ALL MODELS FAILED. Final error: {last_err}")
+        yield FAILURE_MESSAGE
+
+    async def _pump_stream(self, m: str, prompt: str, queue: asyncio.Queue):
+        """
+        Reads one model stream into `queue` (chunks, then _STREAM_END or the error).
+        The semaphore slot is held only while the model produces, not while
+        a slow client reads.
+        """
+        try:
+            async with self.semaphore:
+                stream = await self.client.aio.models.generate_content_stream(
+                    model=m, contents=prompt, config=self._config_for(m, False)
+                )
+                async for chunk in stream:
+                    if chunk.text: queue.put_nowait(chunk.text)
+            queue.put_nowait(_STREAM_END)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    def _ranked_for(self, prompt: str, json_mode: bool):
+        # Skip models whose input limit the prompt would exceed instead of failing through them
+        ranked = self.scoreboard.rank(self.models, json_mode)
+        tokens = estimate_tokens(prompt)
+        return [m for m in ranked if input_limit(m) >= tokens] or ranked
+
+    def prompt_budget(self, json_mode: bool = False):
+        """Token budget for prompts we build: PROMPT_TOKEN_BUDGET, capped by the model that would serve it now."""
+        ranked = self.scoreboard.rank(self.models, json_mode)
+        return min(PROMPT_TOKEN_BUDGET, input_limit(ranked[0])) if ranked else PROMPT_TOKEN_BUDGET
+
+    async def _route(self, prompt: str, json_mode: bool, hedge: bool):
+        candidates = iter(self._ranked_for(prompt, json_mode))
+        if hedge and self.hedging:
+            return await self._generate_hedged(candidates, prompt, json_mode)
+
+        last_err = None
+        while True:
+            m = self._next_model(candidates, json_mode)
+            if m is None: break
+            try:
+                return await self._attempt(m, prompt, json_mode)
+            except Exception as e:
+                last_err = e
+                continue # Skip to next model; the breaker handles backoff
+
+        print(f"❌ ALL MODELS FAILED. Final error: {last_err}")
+        return FAILURE_MESSAGE
+
+    async def _generate_hedged(self, candidates, prompt: str, json_mode: bool):
+        """
+        Speculative execution: if the primary hasn't answered within its
+        LLM_HEDGE_PERCENTILE latency, fire the same prompt at the next candidate.
+        First good answer wins and the loser is cancelled. At most one hedge per
+        request, and only while the global hedge budget has tokens. If one leg of
+        the race fails fast (e.g. a 429) while the other is still pending, the next
+        healthy candidate takes its place instead of waiting out the slow one.
+        """
+        self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_budget)
+        pending = {}
+        last_err = None
+        hedged = False
+
+        def launch():
+            m = self._next_model(candidates, json_mode)
+            if m is None: return None
+            pending[asyncio.ensure_future(self._attempt(m, prompt, json_mode))] = m
+            return m
+
+        primary = launch()
+        try:
+            while pending:
+                delay = None if hedged else self.hedge_delay(primary)
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedged = True
+                    if self._take_hedge_token():
+                        backup = launch()
+                        if backup:
+                            self.hedge_stats["fired"] += 1
+                            print(f"🏁 [ROUTER] {primary} slower than p{int(self.hedge_percentile * 100)} ({delay:.1f}s), hedging with {backup}")
+                    else:
+                        self.hedge_stats["over_budget"] += 1
+                    continue
+
+                for task in done:
+                    m = pending.pop(task)
+                    if task.exception() is None:
+                        if m != primary: self.hedge_stats["won"] += 1
+                        return task.result()
+                    last_err = task.exception()
+
+                # Plain failover once nothing is left in flight
+                if not pending:
+                    primary = launch()
+                elif hedged:
+                    # A leg of the race failed while the other is still running: keep two in flight
+                    replacement = launch()
+                    if replacement:
+                        self.hedge_stats["replaced"] += 1
+                        print(f"🏁 [ROUTER] Hedge leg failed ({last_err}), racing {replacement} instead")
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                # Let the losers finish cancelling, so their exceptions are retrieved
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        print(f"❌ ALL MODELS FAILED. Final error: {last_err}")
+        return FAILURE_MESSAGE
+
+    def hedge_delay(self, model: str):
+        """How long to wait on `model` before hedging: its latency percentile, or a default until we have samples."""
+        p = self.scoreboard.latency_percentile(model, self.hedge_percentile)
+        return p if p is not None else self.hedge_default_delay
+
+    def _take_hedge_token(self):
+        # Token bucket: every request earns `hedge_budget` tokens (capped), a hedge spends one.
+        # LLM_HEDGE_BUDGET=0.1 therefore means at most ~10% extra model calls.
+        if self._hedge_tokens >= 1:
+            self._hedge_tokens -= 1
+            return True
+        return False
+
+    def health(self, json_mode: bool = False):
+        """Scoreboard snapshot for the /models/health endpoint."""
+        return {
+            "routing_order": self.scoreboard.rank(self.models, json_mode),
+            "models": self.scoreboard.snapshot(json_mode),
+            "hedging": {
+                "enabled": self.hedging,
+                "percentile": self.hedge_percentile,
+                "budget": self.hedge_budget,
+                "tokens": round(self._hedge_tokens, 2),
+                **self.hedge_stats,
+            },
+        }
@@ -0,0 +1,34 @@
+# backend/utils/pagination.py
+import json
+import base64
+from bson import ObjectId
+
+
+def encode_cursor(*values):
+    """Opaque keyset cursor for the sort values of the last returned document."""
+    plain = [{"$oid": str(v)} if isinstance(v, ObjectId) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Sort values from encode_cursor(); None when no cursor was given.
+    Raises ValueError for a malformed one (restarting from page 1 would
+    hand a cursor-following client duplicate rows).
+    """
+    if not cursor: return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = [ObjectId(v["$oid"]) if isinstance(v, dict) else v for v in values]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if len(values) != 2:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def keyset_filter(field: str, tiebreak: str, values, descending: bool = False):
+    """Documents strictly after (field, tiebreak) == values in the given sort order."""
+    op = "$lt" if descending else "$gt"
+    value, tie = values
+    return {"$or": [{field: {op: value}}, {field: value, tiebreak: {op: tie}}]}
@@ -0,0 +1,50 @@
+# backend/utils/pipeline.py
+import time
+import asyncio
+
+
+class StagePipeline:
+    """
+    Small dependency graph of async stages for one request.
+    Each stage starts as soon as the stages it depends on have finished and
+    receives their results as arguments, so independent stages overlap.
+    Per-stage start offsets and durations are recorded for /analyze timings.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self._tasks = {}
+        self._timings = {}
+
+    def add(self, name: str, fn, *deps: str):
+        """Schedules `await fn(*results_of_deps)`; returns self for chaining."""
+        async def run():
+            inputs = [await self._tasks[d] for d in deps]
+            begin = time.monotonic()
+            try:
+                return await fn(*inputs)
+            finally:
+                self._timings[name] = {
+                    "start_ms": round((begin - self.started) * 1000, 1),
+                    "duration_ms": round((time.monotonic() - begin) * 1000, 1),
+                }
+        self._tasks[name] = asyncio.ensure_future(run())
+        return self
+
+    async def get(self, name: str):
+        return await self._tasks[name]
+
+    def done(self, name: str):
+        return self._tasks[name].done()
+
+    def cancel(self):
+        """Stops stages nobody is waiting for any more (e.g. after an error)."""
+        for task in self._tasks.values():
+            if not task.done(): task.cancel()
+            elif not task.cancelled(): task.exception()   # mark failures as seen: no "never retrieved" warnings
+
+    def timings(self):
+        return {**self._timings, "total_ms": round((time.monotonic() - self.started) * 1000, 1)}
+
+    def log(self, label: str):
+        parts = ", ".join(f"{k} {v['duration_ms']:.0f}ms@{v['start_ms']:.0f}" for k, v in self._timings.items())
+        print(f"⏱️ [PIPELINE] {label}: {parts} | total {(time.monotonic() - self.started) * 1000:.0f}ms")
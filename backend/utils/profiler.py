@@ -0,0 +1,163 @@
+# backend/utils/profiler.py
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+PROFILE_CHUNK_ROWS = int(os.getenv("PROFILE_CHUNK_ROWS", "250000"))
+DISTINCT_CAP = 10_000   # exact distinct counts up to here, "10000+" beyond (8 bytes per value while building)
+SAMPLE_VALUES = 3
+HEAD_ROWS = 3
+VALUE_CHARS = 40
+
+
+def _plain(value):
+    """Numpy / pandas scalars -> plain Python values Mongo can store."""
+    if value is None: return None
+    if isinstance(value, pd.Timestamp): return value.to_pydatetime()
+    if isinstance(value, (pd.Timedelta, np.timedelta64)): return str(value)
+    if isinstance(value, np.generic): return value.item()
+    if isinstance(value, (str, int, float, bool)): return value
+    return str(value)
+
+
+def _storable(value):
+    """BSON-safe form of a min/max value: ints past int64 (e.g. large uint64) become strings."""
+    if isinstance(value, int) and not isinstance(value, bool) and not -2 ** 63 <= value < 2 ** 63:
+        return str(value)
+    return value
+
+
+def _short(value):
+    text = f"{value:.6g}" if isinstance(value, float) else str(value)
+    return text if len(text) <= VALUE_CHARS else text[:VALUE_CHARS - 3] + "..."
+
+
+class ColumnProfile:
+    def __init__(self, name: str, dtype: str):
+        self.name = name
+        self.dtype = dtype
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.distinct = 0
+        self.distinct_exact = True
+        self.samples = []
+        self._hashes = np.empty(0, dtype=np.uint64)   # in-memory only, dropped on persist
+
+    def update(self, s: pd.Series):
+        self.dtype = str(s.dtype)
+        values = s.dropna()
+        self.nulls += len(s) - len(values)
+        if not len(values): return
+
+        if (pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)) \
+                or pd.api.types.is_datetime64_any_dtype(values):
+            lo, hi = _plain(values.min()), _plain(values.max())
+            try:
+                self.min = lo if self.min is None else min(self.min, lo)
+                self.max = hi if self.max is None else max(self.max, hi)
+            except TypeError:   # restored profile holding a stringified bound
+                pass
+
+        if self.distinct_exact and self._hashes is not None:
+            try:
+                hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+                self._hashes = np.union1d(self._hashes, hashes)
+                self.distinct = len(self._hashes)
+                if self.distinct > DISTINCT_CAP:
+                    self.distinct_exact, self._hashes = False, None
+            except TypeError:
+                # Unhashable cells (lists, dicts): no cardinality
+                self.distinct_exact, self._hashes, self.distinct = False, None, None
+
+        if len(self.samples) < SAMPLE_VALUES:
+            for v in values.head(200):   # no unique(): cells may be unhashable
+                v = _plain(v)
+                if v not in self.samples: self.samples.append(v)
+                if len(self.samples) >= SAMPLE_VALUES: break
+
+    def describe(self):
+        """One prompt line: dtype, nulls, cardinality, range, example values."""
+        parts = [self.dtype, f"nulls {self.nulls:,}"]
+        if self.distinct is not None:
+            parts.append(f"distinct {self.distinct:,}" + ("" if self.distinct_exact else "+"))
+        if self.min is not None:
+            parts.append(f"range {_short(self.min)} .. {_short(self.max)}")
+        if self.samples:
+            parts.append("e.g. " + ", ".join(_short(v) for v in self.samples))
+        return f"- {self.name}: " + ", ".join(parts)
+
+    def to_dict(self):
+        """Persisted form: samples only as their (short) display text, never raw values."""
+        return {
+            "name": self.name, "dtype": self.dtype, "nulls": self.nulls,
+            "min": _storable(self.min), "max": _storable(self.max), "distinct": self.distinct,
+            "distinct_exact": self.distinct_exact, "samples": [_short(v) for v in self.samples],
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        col = cls(d["name"], d["dtype"])
+        col.nulls, col.min, col.max = d["nulls"], d["min"], d["max"]
+        col.distinct, col.samples = d["distinct"], d["samples"]
+        # Hashes aren't persisted: later updates can only raise a lower bound
+        col.distinct_exact, col._hashes = False, None
+        return col
+
+
+class DatasetProfile:
+    """
+    Schema summary computed once at upload and reused by every query, in
+    place of per-query df.info() / df.head(). Built incrementally: update()
+    takes one chunk at a time, so large frames never need a second full copy.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}   # str(column) -> ColumnProfile, in frame order
+        self.head = []      # first rows as records
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, chunk_rows: int = PROFILE_CHUNK_ROWS):
+        profile = cls()
+        for start in range(0, max(len(df), 1), chunk_rows):
+            profile.update(df.iloc[start:start + chunk_rows])
+        return profile
+
+    def update(self, chunk: pd.DataFrame):
+        for col in chunk.columns:
+            key = str(col)
+            if key not in self.columns:
+                self.columns[key] = ColumnProfile(key, str(chunk[col].dtype))
+            self.columns[key].update(chunk[col])
+        if len(self.head) < HEAD_ROWS:
+            rows = chunk.head(HEAD_ROWS - len(self.head))
+            self.head += [{str(k): _plain(v) for k, v in r.items()} for r in rows.to_dict("records")]
+        self.rows += len(chunk)
+        return self
+
+    def to_prompt(self, columns=None):
+        """(schema_text, sample_text) for the analyst prompt, optionally limited to some columns."""
+        names = [c for c in (columns or self.columns) if c in self.columns]
+        schema = [f"ROWS: {self.rows:,} | COLUMNS: {len(self.columns)}"]
+        if len(names) < len(self.columns):
+            schema.append(f"(showing {len(names)} of {len(self.columns)} columns)")
+        schema += [self.columns[c].describe() for c in names]
+        sample = pd.DataFrame(self.head, columns=names).to_string() if self.head else ""
+        return "\n".join(schema), sample
+
+    def to_dict(self):
+        """Persisted form (file_mappings extra): head rows as display text, like the column samples."""
+        head = [{k: None if v is None else _short(v) for k, v in row.items()} for row in self.head]
+        return {"rows": self.rows, "columns": [c.to_dict() for c in self.columns.values()], "head": head}
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        profile = cls()
+        profile.rows, profile.head = d["rows"], d["head"]
+        profile.columns = {c["name"]: ColumnProfile.from_dict(c) for c in d["columns"]}
+        return profile
+
+    def approx_bytes(self):
+        hashes = sum(c._hashes.nbytes for c in self.columns.values() if c._hashes is not None)
+        return hashes + 500 * len(self.columns) + sys.getsizeof(self)
@@ -0,0 +1,143 @@
+# backend/utils/prompt_budget.py
+import os
+import re
+import time
+
+# Input limits (tokens) by model name prefix; first match wins
+MODEL_INPUT_TOKENS = [
+    ("gemini-1.5-pro", 2_000_000),
+    ("gemini", 1_000_000),
+    ("gemma-3-1b", 32_000),
+    ("gemma", 128_000),
+]
+DEFAULT_INPUT_TOKENS = 32_000
+
+# Target size for the prompts we build ourselves. Far below the limits: prompt
+# size drives latency on every call, not just whether the call fits.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+TRANSLATE_CHUNK_TOKENS = int(os.getenv("TRANSLATE_CHUNK_TOKENS", "1500"))
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+_NAME_PARTS = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_QUERY_WORDS = re.compile(r"<(\w{0,4})_\d+>|\w+")
+
+
+def estimate_tokens(text: str):
+    """
+    Local token estimate: ~4 ASCII chars per token, ~1 token per non-ASCII
+    char (CJK, Devanagari...). Errs high, which is the safe side for budgets.
+    """
+    if not text: return 0
+    non_ascii = len(_NON_ASCII.findall(text))
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def input_limit(model: str):
+    for prefix, limit in MODEL_INPUT_TOKENS:
+        if model.startswith(prefix): return limit
+    return DEFAULT_INPUT_TOKENS
+
+
+def log_prompt(stage: str, prompt: str, started: float):
+    """One line per model stage: prompt size and latency."""
+    print(f"📏 [PROMPT] {stage}: ~{estimate_tokens(prompt):,} tokens ({len(prompt):,} chars) in {time.monotonic() - started:.2f}s")
+
+
+# =========================================================
+# 🟢 COLUMN SELECTION FOR WIDE FRAMES
+# =========================================================
+def _name_words(name: str):
+    return {w.lower() for w in _NAME_PARTS.findall(name)} | {name.lower()}
+
+
+def column_scores(profile, query: str):
+    """
+    Relevance of each column to the (protected) query:
+    - column named in the query (as whole words), or words of its name used in it;
+    - vault tokens in the query (<CITY_3>) whose prefix is the column's.
+    """
+    from utils.vault_engine import column_prefix
+    lowered = query.lower()
+    words, prefixes = set(), set()
+    for m in _QUERY_WORDS.finditer(query):
+        if m.group(1) is not None: prefixes.add(m.group(1).upper())
+        else: words.add(m.group(0).lower())
+
+    scores = {}
+    for name in profile.columns:
+        score = 0.0
+        # Whole-name match on word boundaries: "id" must not score inside "paid"
+        if re.search(rf"(?<!\w){re.escape(name.lower())}(?!\w)", lowered): score += 3
+        parts = _name_words(name)
+        score += sum(1 for p in parts if len(p) > 2 and p in words)
+        if prefixes and column_prefix(name) in prefixes: score += 3
+        scores[name] = score
+    return scores
+
+
+def fit_schema(profile, query: str, budget_tokens: int):
+    """
+    (schema_text, sample_text) within `budget_tokens`. Narrow frames come
+    back whole; wide ones keep the most query-relevant columns (frame order
+    breaks ties) and list the rest by name as far as the budget allows.
+    """
+    schema, sample = profile.to_prompt()
+    if estimate_tokens(schema) + estimate_tokens(sample) <= budget_tokens:
+        return schema, sample
+
+    scores = column_scores(profile, query)
+    order = {name: i for i, name in enumerate(profile.columns)}
+    ranked = sorted(profile.columns, key=lambda n: (-scores[n], order[n]))
+
+    # Column lines get ~60% of the budget, names of the others up to 80%, sample rows the rest
+    line_budget = int(budget_tokens * 0.6)
+    kept, used = [], 0
+    for name in ranked:
+        cost = estimate_tokens(profile.columns[name].describe())
+        if used + cost > line_budget: continue
+        kept.append(name)
+        used += cost
+    kept.sort(key=order.get)
+
+    schema, _ = profile.to_prompt(kept)
+    kept_set = set(kept)
+    dropped = [n for n in profile.columns if n not in kept_set]
+    names, name_used = [], 0
+    for name in dropped:
+        name_used += estimate_tokens(name) + 1
+        if used + name_used > int(budget_tokens * 0.8): break
+        names.append(name)
+    if names:
+        more = len(dropped) - len(names)
+        schema += "\nOTHER COLUMNS: " + ", ".join(names) + (f" (+{more} more)" if more else "")
+
+    # Sample rows: only the best-ranked kept columns, so the table stays narrow
+    sample_cols = [n for n in ranked if n in kept_set][:12]
+    _, sample = profile.to_prompt(sorted(sample_cols, key=order.get))
+    if estimate_tokens(schema) + estimate_tokens(sample) > budget_tokens:
+        sample = ""
+    return schema, sample
+
+
+# =========================================================
+# 🟢 TEXT CHUNKING (long translations)
+# =========================================================
+def split_for_budget(text: str, budget_tokens: int = TRANSLATE_CHUNK_TOKENS):
+    """Splits on paragraph breaks (then lines) into pieces of at most ~budget_tokens."""
+    if estimate_tokens(text) <= budget_tokens: return [text]
+
+    pieces, current = [], ""
+    for para in re.split(r"(\n\s*\n)", text):
+        if estimate_tokens(current + para) <= budget_tokens:
+            current += para
+            continue
+        if current.strip(): pieces.append(current)
+        current = ""
+        # A single oversized paragraph: fall back to lines
+        for line in para.splitlines(keepends=True) if estimate_tokens(para) > budget_tokens else [para]:
+            if current and estimate_tokens(current + line) > budget_tokens:
+                pieces.append(current)
+                current = ""
+            current += line
+    if current.strip(): pieces.append(current)
+    return pieces
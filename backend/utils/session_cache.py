@@ -0,0 +1,165 @@
+# backend/utils/session_cache.py
+import os
+import sys
+import pickle
+import tempfile
+import pandas as pd
+
+from utils.lru_cache import LRUCache
+
+
+def session_bytes(entry: dict):
+    """Resident size of a session entry: deep memory usage for frames, string size for documents."""
+    data = entry.get("data")
+    if isinstance(data, pd.DataFrame):
+        size = int(data.memory_usage(deep=True, index=True).sum())
+    elif data is not None:
+        size = sys.getsizeof(data)
+    else:
+        size = 0
+    # Side data (profiles, indexes...) is small next to the data itself; indexes report their own size
+    return size + sum(v.approx_bytes() if hasattr(v, "approx_bytes") else sys.getsizeof(v)
+                      for k, v in entry.items() if k != "data")
+
+
+class SessionCache:
+    """
+    Memory-bounded replacement for the old `active_sessions` dict.
+    - Byte accounting per session and an LRU eviction policy under `max_bytes`.
+    - Evicted sessions spill to a local directory (Parquet for frames,
+      memory-mapped on reload) and are reloaded lazily on the next access.
+      The directory is kept under `spill_max_bytes`, oldest spills first
+      (a dropped spill just means a reload through `loader`).
+    - put() can evict, and eviction writes Parquet: call it off the event loop.
+    - Cold sessions fall back to `loader(session_id) -> entry | None`
+      (e.g. GridFS recovery).
+    """
+    def __init__(self, loader=None, max_bytes: int = None, spill_dir: str = None, spill_max_bytes: int = None):
+        self.loader = loader
+        self.max_bytes = max_bytes or int(os.getenv("SESSION_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+        self.spill_dir = spill_dir or os.getenv("SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "nexus_spill"))
+        self.spill_max_bytes = spill_max_bytes or int(os.getenv("SESSION_SPILL_MAX_BYTES", str(10 * 1024 ** 3)))
+        self._lru = LRUCache(max_bytes=self.max_bytes, sizeof=session_bytes, on_evict=self._spill)
+        self.spill_writes = 0
+        self.spill_loads = 0
+        self.store_loads = 0
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        except Exception as e:
+            print(f"⚠️ Session spill disabled: {e}")
+            self.spill_dir = None
+
+    # --- Spill store ---
+    def _spill_paths(self, session_id: str):
+        base = os.path.join(self.spill_dir, session_id)
+        return base + ".parquet", base + ".meta"
+
+    def _spill(self, session_id: str, entry: dict):
+        if not self.spill_dir: return
+        data_path, meta_path = self._spill_paths(session_id)
+        meta = {k: v for k, v in entry.items() if k != "data"}
+        try:
+            data = entry.get("data")
+            if isinstance(data, pd.DataFrame):
+                try:
+                    data.to_parquet(data_path, compression="zstd")
+                    meta["_spill_format"] = "parquet"
+                except Exception:
+                    meta["_spill_format"] = "pickle"
+                    meta["_data"] = data
+            else:
+                meta["_spill_format"] = "inline"
+                meta["_data"] = data
+            with open(meta_path, "wb") as f:
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.spill_writes += 1
+        except Exception as e:
+            print(f"⚠️ Spill failed for {session_id}: {e}")
+            return
+        self._prune_spill()
+
+    def _prune_spill(self):
+        """Keeps the spill directory under its byte budget, dropping the oldest spills."""
+        try:
+            sizes = {}   # session_id -> [mtime, bytes]
+            for name in os.listdir(self.spill_dir):
+                sid, ext = os.path.splitext(name)
+                if ext not in (".parquet", ".meta"): continue
+                st = os.stat(os.path.join(self.spill_dir, name))
+                entry = sizes.setdefault(sid, [st.st_mtime, 0])
+                entry[0] = max(entry[0], st.st_mtime)
+                entry[1] += st.st_size
+            total = sum(b for _, b in sizes.values())
+            for sid, (_, size) in sorted(sizes.items(), key=lambda kv: kv[1][0]):
+                if total <= self.spill_max_bytes: break
+                self._drop_spill(sid)
+                total -= size
+        except Exception as e:
+            print(f"⚠️ Spill prune failed: {e}")
+
+    def _unspill(self, session_id: str):
+        if not self.spill_dir: return None
+        data_path, meta_path = self._spill_paths(session_id)
+        if not os.path.exists(meta_path): return None
+        try:
+            with open(meta_path, "rb") as f:
+                meta = pickle.load(f)
+            fmt = meta.pop("_spill_format")
+            data = pd.read_parquet(data_path, memory_map=True) if fmt == "parquet" else meta.pop("_data")
+            self.spill_loads += 1
+            return {"data": data, **meta}
+        except Exception as e:
+            print(f"⚠️ Spill reload failed for {session_id}: {e}")
+            return None
+
+    def _drop_spill(self, session_id: str):
+        if not self.spill_dir: return
+        for path in self._spill_paths(session_id):
+            if os.path.exists(path):
+                try: os.remove(path)
+                except OSError: pass
+
+    # --- Public API ---
+    def get(self, session_id: str):
+        """Resident entry only; never touches disk or the database."""
+        return self._lru.get(session_id)
+
+    def load(self, session_id: str):
+        """Resident entry, else spill, else loader. Blocking: call off the event loop."""
+        entry = self._lru.get(session_id)
+        if entry is not None: return entry
+
+        entry = self._unspill(session_id)
+        if entry is None and self.loader is not None:
+            entry = self.loader(session_id)
+            if entry is not None: self.store_loads += 1
+        if entry is not None:
+            self._lru.set(session_id, entry)
+        return entry
+
+    def put(self, session_id: str, entry: dict):
+        """May evict (and spill) other sessions. Blocking: call off the event loop."""
+        self._drop_spill(session_id)
+        self._lru.set(session_id, entry)
+
+    def pop(self, session_id: str):
+        self._drop_spill(session_id)
+        return self._lru.pop(session_id)
+
+    def __contains__(self, session_id: str):
+        return session_id in self._lru
+
+    def stats(self):
+        lru = self._lru.stats()
+        return {
+            "resident_sessions": lru["entries"],
+            "resident_bytes": lru["bytes"],
+            "max_bytes": self.max_bytes,
+            "hits": lru["hits"],
+            "misses": lru["misses"],
+            "evictions": lru["evictions"],
+            "spill_writes": self.spill_writes,
+            "spill_loads": self.spill_loads,
+            "spill_max_bytes": self.spill_max_bytes,
+            "store_loads": self.store_loads,
+        }
@@ -0,0 +1,267 @@
+# backend/utils/vault_engine.py
+import re
+import numpy as np
+import pandas as pd
+
+_END = ""   # trie leaf marker
+
+
+def _is_word(ch: str):
+    # Same definition of a word character as the re module's \w for str patterns
+    return ch.isalnum() or ch == "_"
+
+
+def fold_text(text: str):
+    # Per-character case folding keeps offsets aligned with the original text
+    return "".join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+
+
+def word_starts(text: str):
+    """Offsets where a \\b-anchored match may start."""
+    return [i for i in range(len(text)) if _is_word(text[i]) != (i > 0 and _is_word(text[i - 1]))]
+
+
+def is_word_end(text: str, end: int):
+    return end == len(text) or _is_word(text[end - 1]) != _is_word(text[end])
+
+
+def boundary_candidates(text: str, max_len: int):
+    """
+    Every folded substring that starts and ends on a word boundary and is at
+    most `max_len` long: exactly the strings protect() could ever match, so a
+    targeted store lookup on them finds every entity in the text.
+    """
+    folded = fold_text(text)
+    out = set()
+    for start in word_starts(text):
+        for end in range(start + 1, min(len(text), start + max_len) + 1):
+            if is_word_end(text, end):
+                out.add(folded[start:end])
+    return out
+
+
+def _build_trie(keys):
+    trie = {}
+    for key in keys:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_END] = key
+    return trie
+
+
+class EntityMatcher:
+    """
+    Compiled matcher for VaultAgent.protect, built once per token map.
+    Same semantics as the old per-key loop: whole words only (\\b), case
+    folded, and longer entities win over shorter ones they overlap with
+    ("New York" before "New").
+    """
+    def __init__(self, forward_map: dict):
+        self.forward_map = forward_map
+        self.trie = _build_trie(k for k in forward_map if k)
+        # The old loop tried keys longest first and, within a length, in map order
+        self.rank = {k: i for i, k in enumerate(forward_map)}
+
+    def _ends_at(self, text: str, folded: str, start: int):
+        """Walks the trie from `start`; returns the end of every key that also ends on a word boundary."""
+        node = self.trie
+        ends = []
+        for i in range(start, len(folded)):
+            node = node.get(folded[i])
+            if node is None: break
+            if _END in node and is_word_end(text, i + 1):
+                ends.append(i + 1)
+        return ends
+
+    def replace(self, text: str):
+        """Returns (protected_text, number of distinct entities replaced)."""
+        if not self.trie or not text:
+            return text, 0
+
+        folded = fold_text(text)
+
+        # Every entity starting at each word boundary (one trie walk per boundary):
+        # when the longest one loses to an overlapping longer pick, a shorter
+        # one at the same start ("new" in "new york city hall") must still get its turn
+        candidates = [(start, end) for start in word_starts(text) for end in self._ends_at(text, folded, start)]
+
+        # Longest first (map order among equal lengths), then left-to-right; drop anything overlapping an earlier pick
+        taken = []
+        occupied = []
+        ranked = sorted(candidates, key=lambda se: (se[0] - se[1], self.rank.get(folded[se[0]:se[1]], 0), se[0]))
+        for start, end in ranked:
+            if any(start < o_end and o_start < end for o_start, o_end in occupied):
+                continue
+            token = self.forward_map.get(folded[start:end])
+            if token is None:
+                continue
+            occupied.append((start, end))
+            taken.append((start, end, token))
+
+        if not taken:
+            return text, 0
+
+        taken.sort()
+        out, pos = [], 0
+        for start, end, token in taken:
+            out.append(text[pos:start])
+            out.append(token)
+            pos = end
+        out.append(text[pos:])
+        return "".join(out), len({t for _, _, t in taken})
+
+
+# Vault tokens always look like <PREFIX_n>: PREFIX is up to 4 word chars from the column name
+TOKEN_PATTERN = re.compile(r"<\w{0,4}_\d+>")
+
+
+def restore_tokens(text: str, reverse_map: dict):
+    """
+    Single regex scan over the response: cost scales with the text, not the
+    map. Unknown tokens are left untouched.
+    """
+    if not text or not reverse_map: return text
+    return TOKEN_PATTERN.sub(lambda m: reverse_map.get(m.group(0), m.group(0)), text)
+
+
+# A chunk tail that could still grow into a token: "<", "<CIT", "<CITY_", "<CITY_1"
+PARTIAL_TOKEN = re.compile(r"<\w{0,4}(?:_\d*)?$")
+
+
+class StreamRestorer:
+    """
+    Incremental restore for streamed model output. Text is released as soon
+    as it can't be the start of a token; a tail like "<CITY_1" is held back
+    until the next chunk decides it, so a token is never split across chunks.
+    `restore(text) -> text` does the actual replacement (e.g. VaultAgent.restore).
+    """
+    def __init__(self, restore):
+        self.restore = restore
+        self.pending = ""
+
+    def feed(self, chunk: str):
+        text = self.pending + (chunk or "")
+        m = PARTIAL_TOKEN.search(text)
+        cut = m.start() if m else len(text)
+        self.pending = text[cut:]
+        return self.restore(text[:cut]) if cut else ""
+
+    def flush(self):
+        text, self.pending = self.pending, ""
+        return self.restore(text) if text else ""
+
+
+def find_tokens(text: str):
+    """Distinct tokens present in a text (used for targeted map lookups)."""
+    return set(TOKEN_PATTERN.findall(text or ""))
+
+
+def collect_tokens(obj):
+    """Distinct tokens anywhere inside a chart payload."""
+    if isinstance(obj, str):
+        return find_tokens(obj)
+    found = set()
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            found |= collect_tokens(k) | collect_tokens(v)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            found |= collect_tokens(v)
+    return found
+
+
+def restore_structure(obj, reverse_map: dict):
+    """
+    Restores tokens inside chart payloads (dicts / lists / tuples of strings)
+    in place of the old json.dumps -> restore -> json.loads round-trip.
+    Non-string leaves (numbers, None, numpy scalars) are returned as-is.
+    """
+    if isinstance(obj, str):
+        return restore_tokens(obj, reverse_map)
+    if isinstance(obj, dict):
+        return {restore_structure(k, reverse_map): restore_structure(v, reverse_map) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(restore_structure(v, reverse_map) for v in obj)
+    return obj
+
+
+def column_prefix(col) -> str:
+    # Create a generic prefix from the column name (e.g. 'PatientID' -> 'PATI')
+    return re.sub(r'\W+', '', str(col)).upper()[:4]
+
+
+def average_text_length(codes: np.ndarray, uniques) -> float:
+    """
+    Mean of len(str(value)) over the column, computed from factorize output:
+    one len() per distinct value, weighted by its count. Missing values
+    count as "nan" (3 chars) like the old astype(str) scan.
+    """
+    if len(codes) == 0: return 0.0
+    lens = np.fromiter((len(str(v)) for v in uniques), dtype=np.int64, count=len(uniques))
+    present = codes[codes >= 0]
+    counts = np.bincount(present, minlength=len(uniques))
+    n_missing = len(codes) - len(present)
+    return float((lens * counts).sum() + 3 * n_missing) / len(codes)
+
+
+class ColumnTokenizer:
+    """
+    Vectorized tokenization for one column, fed one or more chunks.
+    Values are factorized to integer codes; tokens are assigned per distinct
+    value in order of first appearance (<PREFIX_i>, same numbering as the old
+    per-value loop) and the shadow column is a single take() on the codes.
+    Distinct values seen in earlier chunks keep their token.
+    """
+    def __init__(self, col):
+        self.col = col
+        self.prefix = column_prefix(col)
+        self.known = None       # pd.Index of distinct values seen so far (global order)
+        self.tokenized = False  # any value long enough to get a token yet?
+
+    def factorize(self, series: pd.Series):
+        return pd.factorize(series, sort=False)
+
+    def apply(self, series: pd.Series, codes=None, uniques=None):
+        """Returns (shadow_series, forward_entries, reverse_entries) for this chunk."""
+        if codes is None:
+            codes, uniques = self.factorize(series)
+        uniques = pd.Index(uniques).astype(object)
+
+        # Map chunk-local distinct values to global first-appearance indices
+        if self.known is None:
+            global_idx = np.arange(len(uniques))
+            new_mask = np.ones(len(uniques), dtype=bool)
+            self.known = uniques
+        else:
+            global_idx = self.known.get_indexer(uniques)
+            new_mask = global_idx < 0
+            global_idx[new_mask] = np.arange(len(self.known), len(self.known) + new_mask.sum())
+            self.known = self.known.append(uniques[new_mask])
+
+        # The only per-item Python work: one pass over the chunk's distinct values.
+        # CRITICAL FIX: Ignore very short values (e.g. "A", "B", "1")
+        # This prevents replacing every letter "a" in a sentence.
+        prefix = self.prefix
+        stripped = [str(v).strip() for v in uniques]
+        tokens = [f"<{prefix}_{g}>" if len(v) >= 2 else None for v, g in zip(stripped, global_idx.tolist())]
+        self.tokenized = self.tokenized or any(t is not None for t in tokens)
+        out_vals = np.empty(len(uniques), dtype=object)
+        out_vals[:] = [t if t is not None else v for t, v in zip(tokens, uniques)]
+
+        # Store Map (Lower case for robust matching), new values only
+        new_rows = [(v, t) for v, t, is_new in zip(stripped, tokens, new_mask.tolist()) if t is not None and is_new]
+        forward = {v.lower(): t for v, t in new_rows}
+        reverse = {t: v for v, t in new_rows}
+
+        if isinstance(series.dtype, pd.CategoricalDtype) and pd.Index(out_vals).is_unique:
+            # Stay categorical: the codes are reused as-is, no per-row objects
+            shadow = pd.Series(pd.Categorical.from_codes(codes, categories=out_vals), index=series.index, name=series.name)
+        else:
+            values = out_vals.take(codes) if len(out_vals) else np.empty(len(codes), dtype=object)
+            missing = codes < 0
+            if missing.any():
+                # Keep the original missing markers (None / NaN) untouched
+                values[missing] = series.to_numpy(dtype=object)[missing]
+            shadow = pd.Series(values, index=series.index, name=series.name, dtype=object)
+        return shadow, forward, reverse
@@ -0,0 +1,93 @@
+# backend/utils/vault_store.py
+from datetime import datetime
+
+
+class VaultMappingStore:
+    """
+    Sharded storage for vault token maps.
+    - `vault_mappings` keeps one small meta document per session
+      (version stamp, entry count, longest key) instead of the full maps,
+      so high-cardinality sessions never approach Mongo's 16MB limit.
+    - `vault_entries` holds one document per token:
+      {session_id, token, original, key}, where `key` is the lower-cased
+      value protect() matches on (absent when another column owns that key).
+    Indexed on (session_id, token) and (session_id, key) for targeted lookups
+    (created at startup by utils.db_indexes.ensure_indexes).
+    """
+    def __init__(self, db, batch_size: int = 5000):
+        self.db = db
+        self.batch_size = batch_size
+
+    def get_meta(self, session_id: str, version_only: bool = False):
+        projection = {"version": 1, "_id": 0} if version_only else None
+        return self.db.vault_mappings.find_one({"session_id": session_id}, projection)
+
+    def save(self, session_id: str, forward: dict, reverse: dict, version: str):
+        """Bulk-writes all entries for a session, then flips the meta document to the new version."""
+        self.db.vault_entries.delete_many({"session_id": session_id})
+
+        key_of = {token: key for key, token in forward.items()}
+        batch = []
+        for token, original in reverse.items():
+            doc = {"session_id": session_id, "token": token, "original": original}
+            if token in key_of: doc["key"] = key_of[token]
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                self.db.vault_entries.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            self.db.vault_entries.insert_many(batch, ordered=False)
+
+        # Meta last: readers only see the new version once every entry is in place
+        self.db.vault_mappings.replace_one(
+            {"session_id": session_id},
+            {
+                "session_id": session_id,
+                "storage": "sharded",
+                "version": version,
+                "entries": len(reverse),
+                "max_key_len": max((len(k) for k in forward), default=0),
+                "updated_at": datetime.now(),
+            },
+            upsert=True
+        )
+
+    def load_all(self, session_id: str):
+        """Full (forward, reverse) maps, for sessions small enough to keep in memory."""
+        forward, reverse = {}, {}
+        cursor = self.db.vault_entries.find({"session_id": session_id}, {"_id": 0, "token": 1, "original": 1, "key": 1})
+        for doc in cursor:
+            reverse[doc["token"]] = doc["original"]
+            if "key" in doc: forward[doc["key"]] = doc["token"]
+        return forward, reverse
+
+    def lookup_keys(self, session_id: str, keys):
+        """{key: token} for the candidate values that are actually entities."""
+        keys = list(keys)
+        if not keys: return {}
+        cursor = self.db.vault_entries.find(
+            {"session_id": session_id, "key": {"$in": keys}},
+            {"_id": 0, "key": 1, "token": 1}
+        )
+        return {doc["key"]: doc["token"] for doc in cursor}
+
+    def lookup_tokens(self, session_id: str, tokens):
+        """{token: original} for tokens found in a response."""
+        tokens = list(tokens)
+        if not tokens: return {}
+        cursor = self.db.vault_entries.find(
+            {"session_id": session_id, "token": {"$in": tokens}},
+            {"_id": 0, "token": 1, "original": 1}
+        )
+        return {doc["token"]: doc["original"] for doc in cursor}
+
+    def delete(self, session_id: str):
+        self.db.vault_entries.delete_many({"session_id": session_id})
+        self.db.vault_mappings.delete_one({"session_id": session_id})
+
+    def delete_many(self, session_ids):
+        """Batch form of delete() for the lifecycle sweeper."""
+        session_ids = list(session_ids)
+        if not session_ids: return
+        self.db.vault_entries.delete_many({"session_id": {"$in": session_ids}})
+        self.db.vault_mappings.delete_many({"session_id": {"$in": session_ids}})
@@ -0,0 +1,206 @@
+# backend/utils/write_behind.py
+import os
+import asyncio
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "0.5"))
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "5000"))
+MAX_ATTEMPTS = 3
+
+
+class HistoryWriter:
+    """
+    Write-behind queue for chat history and session metadata.
+    - Requests enqueue and return; a background task flushes every
+      HISTORY_FLUSH_SECONDS, or as soon as HISTORY_BATCH_SIZE ops are waiting,
+      as one insert_many (messages) + one ordered bulk_write (sessions).
+    - Repeated `$set`s on the same session between flushes are merged.
+    - Backpressure: past HISTORY_MAX_PENDING queued ops (Mongo slow or down)
+      the enqueuing request waits for a flush instead of growing the queue.
+    - Read-your-writes: readers call `flush_for(...)` first, which flushes
+      only if something relevant (that session's writes, or a new session
+      of that user) is still queued.
+    - Failed batches are retried (up to 3 attempts); shutdown flushes what's left.
+    """
+    def __init__(self, db, batch_size: int = None, flush_seconds: float = None, max_pending: int = None):
+        self.db = db
+        self.batch_size = batch_size or HISTORY_BATCH_SIZE
+        self.flush_seconds = flush_seconds or HISTORY_FLUSH_SECONDS
+        self.max_pending = max_pending or HISTORY_MAX_PENDING
+        self._messages = []          # [(doc, attempts)]
+        self._sessions = []          # [({"session_id", "insert": doc} | {"session_id", "set": fields}, attempts)]
+        self._session_updates = {}   # session_id -> index of its pending $set in _sessions
+        self._pending_sids = set()
+        self._inflight_sids = set()  # sessions whose writes a running flush is applying
+        self._pending_users = set()  # users with a queued new session doc
+        self._inflight_users = set()
+        self._task = None
+        self._wake = None
+        self._flush_lock = None
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+
+    # --- Lifecycle ---
+    def start(self):
+        """Starts the background flusher (call from the running event loop, e.g. app startup)."""
+        if self.db is None or self._task is not None: return
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None: return
+        self._task.cancel()
+        try: await self._task
+        except asyncio.CancelledError: pass
+        self._task = None
+        await self.flush()
+        if self.pending:
+            print(f"⚠️ [HISTORY] {self.pending} writes could not be flushed on shutdown")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self.pending:
+                await self.flush()
+
+    @property
+    def pending(self):
+        return len(self._messages) + len(self._sessions)
+
+    # --- Enqueue ---
+    async def add_message(self, doc: dict):
+        if self.db is None: return
+        self._messages.append((doc, 0))
+        await self._queued(doc.get("session_id"))
+
+    async def insert_session(self, doc: dict):
+        if self.db is None: return
+        self._sessions.append(({"session_id": doc.get("session_id"), "insert": doc}, 0))
+        if doc.get("user_email"): self._pending_users.add(doc["user_email"])
+        await self._queued(doc.get("session_id"))
+
+    async def update_session(self, session_id: str, fields: dict):
+        if self.db is None: return
+        idx = self._session_updates.get(session_id)
+        if idx is not None:
+            # Coalesce: one $set per session per flush
+            self._sessions[idx][0]["set"].update(fields)
+            return
+        self._session_updates[session_id] = len(self._sessions)
+        self._sessions.append(({"session_id": session_id, "set": dict(fields)}, 0))
+        await self._queued(session_id)
+
+    async def _queued(self, session_id: str):
+        if session_id: self._pending_sids.add(session_id)
+        if self._task is None:
+            await self.flush()   # no background flusher (e.g. scripts): write through
+        elif self.pending >= self.max_pending:
+            print(f"⏳ [HISTORY] {self.pending} writes queued, applying backpressure")
+            await self.flush()
+        elif self.pending >= self.batch_size:
+            self._wake.set()
+
+    # --- Read-your-writes ---
+    async def flush_for(self, session_id: str = None, user_email: str = None):
+        """
+        Flushes if writes for `session_id`, or a new session of `user_email`,
+        are still queued. (Queued updated_at stamps don't force a flush for
+        listings: they land within HISTORY_FLUSH_SECONDS anyway.)
+        """
+        queued = session_id and (session_id in self._pending_sids or session_id in self._inflight_sids)
+        queued = queued or (user_email and (user_email in self._pending_users or user_email in self._inflight_users))
+        if queued:
+            await self.flush()   # also waits out a flush already in flight
+
+    # --- Flush ---
+    async def flush(self):
+        if self.db is None: return
+        lock = self._flush_lock or asyncio.Lock()
+        async with lock:
+            messages, self._messages = self._messages, []
+            sessions, self._sessions = self._sessions, []
+            self._session_updates = {}
+            self._inflight_sids, self._pending_sids = self._pending_sids, set()
+            self._inflight_users, self._pending_users = self._pending_users, set()
+            if not messages and not sessions: return
+
+            try:
+                # Sessions first: a session's doc exists before its messages do.
+                # If that batch failed, the messages wait for the retry too.
+                if sessions and not await self._write(sessions, self._bulk_sessions, self._requeue_sessions):
+                    self._requeue_messages(messages, bump=False)
+                elif messages:
+                    await self._write(messages, self._insert_messages, self._requeue_messages)
+                self.flushes += 1
+            finally:
+                self._inflight_sids = set()
+                self._inflight_users = set()
+
+    async def _write(self, items, write, requeue):
+        """True when nothing had to be requeued."""
+        try:
+            await asyncio.to_thread(write, [x for x, _ in items])
+            self.written += len(items)
+            return True
+        except BulkWriteError as e:
+            # Ordered batch: everything before the failing op is in, the failing op is dropped
+            errors = e.details.get("writeErrors") or [{"index": 0}]
+            bad = errors[0]["index"]
+            print(f"⚠️ [HISTORY] Write error, dropping 1 op: {errors[0].get('errmsg', e)}")
+            self.written += bad
+            self.failed += 1
+            requeue(items[bad + 1:], bump=False)
+            return bad + 1 == len(items)
+        except Exception as e:
+            print(f"⚠️ [HISTORY] Flush failed ({e}), will retry")
+            requeue(items, bump=True)
+            return False
+
+    def _insert_messages(self, docs):
+        self.db.messages.insert_many(docs, ordered=True)
+
+    def _bulk_sessions(self, specs):
+        ops = [InsertOne(s["insert"]) if "insert" in s else UpdateOne({"session_id": s["session_id"]}, {"$set": s["set"]})
+               for s in specs]
+        self.db.sessions.bulk_write(ops, ordered=True)
+
+    def _retry(self, items, bump: bool):
+        keep = []
+        for x, attempts in items:
+            attempts += 1 if bump else 0
+            if attempts >= MAX_ATTEMPTS:
+                self.failed += 1
+                continue
+            keep.append((x, attempts))
+        if len(keep) < len(items):
+            print(f"❌ [HISTORY] Dropped {len(items) - len(keep)} writes after {MAX_ATTEMPTS} attempts")
+        return keep
+
+    def _requeue_messages(self, items, bump: bool):
+        keep = self._retry(items, bump)
+        self._messages = keep + self._messages
+        self._pending_sids.update(doc.get("session_id") for doc, _ in keep)
+
+    def _requeue_sessions(self, items, bump: bool):
+        keep = self._retry(items, bump)
+        # Indexes of coalescable updates shift; simply stop coalescing into the old ones
+        self._sessions = keep + self._sessions
+        self._session_updates = {}
+        self._pending_sids.update(spec["session_id"] for spec, _ in keep)
+        self._pending_users.update(spec["insert"]["user_email"] for spec, _ in keep if spec.get("insert", {}).get("user_email"))
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+        }
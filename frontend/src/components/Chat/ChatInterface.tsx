@@ -18,39 +18,101 @@ interface Message {
   };
 }
 
+const HISTORY_PAGE_SIZE = 50;
+
+const STAGE_LABELS: Record<string, string> = {
+  received: "Request received",
+  loading_session: "Loading your dataset...",
+  translating_query: "Understanding your question...",
+  analyzing: "Running the analysis...",
+  responding: "Writing the answer...",
+};
+
 export function ChatInterface({ sessionId }: { sessionId: string | null }) {
   const [input, setInput] = useState('');
   const [messages, setMessages] = useState<Message[]>([]);
   const [loading, setLoading] = useState(false);
   const [activeDomain, setActiveDomain] = useState<string>("General");
   const [localSessionId, setLocalSessionId] = useState<string | null>(null);
+  const [streamingId, setStreamingId] = useState<string | null>(null);
+  const [stage, setStage] = useState<string | null>(null);
+  const [hasMore, setHasMore] = useState(false);
   
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const loadMoreRef = useRef<HTMLDivElement>(null);
+  // Keyset paging: X-Next-Cursor is the position after the last loaded message
+  const cursorRef = useRef<string | null>(null);
+  const fetchingRef = useRef(false);
+  const skipScrollRef = useRef(false);
+  // Current values for the async fetches and the poll timer, which outlive renders
+  const sessionIdRef = useRef(sessionId);
+  const hasMoreRef = useRef(hasMore);
+  const loadingRef = useRef(loading);
+  hasMoreRef.current = hasMore;
+  loadingRef.current = loading;
   const currentSessionId = sessionId || localSessionId;
 
-  // Scroll to bottom
+  // Scroll to bottom (not when an older history page was appended)
   useEffect(() => {
+    if (skipScrollRef.current) { skipScrollRef.current = false; return; }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   }, [messages, loading]);
 
-  // Load History
+  // One page after the cursor; polls skip chart payloads
+  const fetchPage = async (sid: string, poll: boolean) => {
+    if (fetchingRef.current) return;
+    fetchingRef.current = true;
+    try {
+        const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE) });
+        if (cursorRef.current) params.set('cursor', cursorRef.current);
+        if (poll) params.set('charts', 'false');
+        const res = await fetch(`http://localhost:8000/sessions/${sid}/messages?${params}`);
+        if (!res.ok) return;
+        const page: Message[] = await res.json();
+        if (sid !== sessionIdRef.current) return;   // switched sessions meanwhile
+        cursorRef.current = res.headers.get('X-Next-Cursor') || cursorRef.current;
+        if (!poll) setHasMore(page.length === HISTORY_PAGE_SIZE);
+        if (page.length) {
+            if (!poll) skipScrollRef.current = true;
+            // Messages sent from this tab are already shown under local ids
+            setMessages(prev => {
+                const seen = new Set(prev.map(m => `${m.role}\u0000${m.content}`));
+                const fresh = page.filter(m => !seen.has(`${m.role}\u0000${m.content}`));
+                return fresh.length ? [...prev, ...fresh] : prev;
+            });
+        }
+    } catch (e) { console.error(e); }
+    finally { fetchingRef.current = false; }
+  };
+
+  // Load History: first page now, the rest on scroll, then poll for new messages
   useEffect(() => {
-    if (sessionId) {
-        setLocalSessionId(null); 
-        const fetchMessages = async () => {
-            try {
-                const res = await fetch(`http://localhost:8000/sessions/${sessionId}/messages`);
-                const data = await res.json();
-                setMessages(data);
-            } catch (e) { console.error(e); }
-        };
-        fetchMessages();
-    } else {
-        setLocalSessionId(null); 
-        setMessages([]); 
-    }
+    sessionIdRef.current = sessionId;
+    cursorRef.current = null;
+    fetchingRef.current = false;
+    setHasMore(false);
+    setLocalSessionId(null); 
+    setMessages([]); 
+    if (!sessionId) return;
+
+    fetchPage(sessionId, false);
+    const interval = setInterval(() => {
+        if (!hasMoreRef.current && !loadingRef.current) fetchPage(sessionId, true);
+    }, 5000);
+    return () => clearInterval(interval);
   }, [sessionId]);
 
+  // Next history page once the end of the list scrolls into view
+  useEffect(() => {
+    const el = loadMoreRef.current;
+    if (!sessionId || !hasMore || !el) return;
+    const observer = new IntersectionObserver(entries => {
+        if (entries[0].isIntersecting) fetchPage(sessionId, false);
+    });
+    observer.observe(el);
+    return () => observer.disconnect();
+  }, [sessionId, hasMore, messages]);
+
   const sendMessage = async (e?: React.FormEvent, overrideText?: string) => {
     e?.preventDefault();
     const textToSend = overrideText || input;
@@ -64,9 +126,14 @@ export function ChatInterface({ sessionId }: { sessionId: string | null }) {
     setMessages(prev => [...prev, userMsg]);
     setLoading(true);
 
+    const aiId = (Date.now() + 1).toString();
+    const updateAi = (patch: (m: Message) => Message) =>
+      setMessages(prev => prev.map(m => m.id === aiId ? patch(m) : m));
+
     try {
       const token = await auth.currentUser?.getIdToken();
-      const response = await fetch("http://localhost:8000/analyze", {
+      // 🟢 Streaming endpoint: stage events right away, then the answer as it is generated
+      const response = await fetch("http://localhost:8000/analyze/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json", "Authorization": `Bearer ${token}` },
         body: JSON.stringify({ 
@@ -76,32 +143,74 @@ export function ChatInterface({ sessionId }: { sessionId: string | null }) {
         })
       });
 
-      if (!response.ok) throw new Error("Server Error");
+      if (!response.ok || !response.body) throw new Error("Server Error");
 
-      const data = await response.json();
-      if (data.domain) setActiveDomain(data.domain);
-      if (data.session_id && !currentSessionId) {
-          setLocalSessionId(data.session_id);
-      }
+      let started = false;
+      const startAi = () => {
+        if (started) return;
+        started = true;
+        setStreamingId(aiId);
+        setMessages(prev => [...prev, {
+          id: aiId, role: 'assistant', content: '', timestamp: new Date().toISOString(),
+          metadata: { privacyScore: 100, agent: "Swarm", domain: "General" }
+        }]);
+      };
 
-      const aiMsg: Message = {
-        id: (Date.now() + 1).toString(), 
-        role: 'assistant', 
-        content: data.analysis, 
-        timestamp: new Date().toISOString(),
-        metadata: {
-            privacyScore: data.privacyScore || 100, 
-            agent: data.agent || "Swarm", 
-            domain: data.domain || "General",
-            chart: data.chart // 🟢 CRITICAL FIX: Pass the chart data to the UI
+      const handleEvent = (event: string, data: any) => {
+        if (event === 'stage') {
+          setStage(data.stage);
+          if (data.session_id && !currentSessionId) setLocalSessionId(data.session_id);
+        } else if (event === 'chart') {
+          startAi();
+          updateAi(m => ({ ...m, metadata: { ...m.metadata, chart: data } })); // 🟢 Chart arrives as its own event
+        } else if (event === 'delta') {
+          startAi();
+          updateAi(m => ({ ...m, content: m.content + data.text }));
+        } else if (event === 'done') {
+          startAi();
+          if (data.domain) setActiveDomain(data.domain);
+          updateAi(m => ({
+            ...m,
+            content: data.analysis,
+            metadata: {
+              ...m.metadata,
+              privacyScore: data.privacyScore || 100,
+              agent: data.agent || "Swarm",
+              domain: data.domain || "General",
+              chart: data.chart
+            }
+          }));
         }
       };
-      setMessages(prev => [...prev, aiMsg]);
+
+      // Minimal SSE parser over the fetch body (EventSource can't POST)
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+          const raw = buffer.slice(0, sep);
+          buffer = buffer.slice(sep + 2);
+          let event = 'message';
+          let payload = '';
+          for (const line of raw.split('\n')) {
+            if (line.startsWith('event: ')) event = line.slice(7);
+            else if (line.startsWith('data: ')) payload += line.slice(6);
+          }
+          if (payload) handleEvent(event, JSON.parse(payload));
+        }
+      }
     } catch (error: any) {
       setMessages(prev => [...prev, {
         id: Date.now().toString(), role: 'assistant', content: `⚠️ Error: ${error.message}`, timestamp: new Date().toISOString()
       }]);
     }
+    setStreamingId(null);
+    setStage(null);
     setLoading(false);
   };
 
@@ -210,7 +319,7 @@ export function ChatInterface({ sessionId }: { sessionId: string | null }) {
                     <ChatMessage key={msg.id} message={msg} />
                 ))}
                 
-                {loading && messages.length > 1 && (
+                {loading && !streamingId && messages.length > 1 && (
                     <div className="flex justify-start max-w-4xl mx-auto animate-in fade-in slide-in-from-bottom-2 duration-300">
                         <div className="w-10 h-10 rounded-xl bg-cyan-900/20 flex items-center justify-center border border-cyan-500/30 mt-1">
                             <Bot size={20} className="text-cyan-400 animate-pulse" />
@@ -219,11 +328,12 @@ export function ChatInterface({ sessionId }: { sessionId: string | null }) {
                             <Loader2 size={20} className="animate-spin text-cyan-400" />
                             <div className="flex flex-col">
                                 <span className="text-cyan-100 font-medium text-sm animate-pulse">Nexus Swarm is thinking...</span>
-                                <span className="text-cyan-500/60 text-xs">Analyzing privacy vault & cloud data</span>
+                                <span className="text-cyan-500/60 text-xs">{stage ? STAGE_LABELS[stage] || stage : "Analyzing privacy vault & cloud data"}</span>
                             </div>
                         </div>
                     </div>
                 )}
+                {hasMore && <div ref={loadMoreRef} className="h-1" />}
                 <div ref={messagesEndRef} />
             </div>
             <div className="flex-shrink-0 p-6 bg-[#0B0C15] border-t border-white/5 z-20">
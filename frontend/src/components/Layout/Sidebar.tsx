@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Plus, MessageSquare, Trash2, FileText } from 'lucide-react';
 
 interface SidebarProps {
@@ -11,35 +11,76 @@ interface SidebarProps {
 
 export function Sidebar({ isOpen, user, activeSessionId, onSessionSelect }: SidebarProps) {
   const [sessions, setSessions] = useState<any[]>([]);
+  // Keyset paging: X-Next-Cursor of the last loaded page, null once everything is loaded
+  const cursorRef = useRef<string | null>(null);
+  const loadingMoreRef = useRef(false);
+  const loadMoreRef = useRef<() => void>(() => {});
 
   // 🟢 FIX: Fetch from Backend API (MongoDB) instead of Firestore
   useEffect(() => {
     if (!user?.email) return;
+    cursorRef.current = null;
+    let pages = 0;
 
+    // First page only (newest first); older pages load on scroll
     const fetchSessions = async () => {
       try {
-        console.log("Fetching history for:", user.email); // 👈 Debug Log 1
         const res = await fetch('http://localhost:8000/sessions', {
             headers: { 'user-email': user.email }
         });
-        if (res.ok) {
-            const data = await res.json();
-            console.log("Backend returned:", data); // 👈 Debug Log 2 (Likely empty array [] right now)
-            setSessions(data);
+        if (!res.ok) return;
+        const first: any[] = await res.json();
+        const next = res.headers.get('X-Next-Cursor');
+        if (pages <= 1) {
+            pages = 1;
+            cursorRef.current = next;
+            setSessions(first);
+        } else {
+            // Older pages are loaded: refresh the head, keep what lies past it
+            const ids = new Set(first.map(s => s.id));
+            const oldest = first.length ? first[first.length - 1].created_at : null;
+            setSessions(prev => [...first, ...prev.filter(s => !ids.has(s.id) && (!next || (oldest && s.created_at < oldest)))]);
         }
       } catch (error) {
         console.error("Failed to load history:", error);
       }
     };
+    loadMoreRef.current = async () => {
+      const cursor = cursorRef.current;
+      if (!cursor || loadingMoreRef.current) return;
+      loadingMoreRef.current = true;
+      try {
+        const res = await fetch(`http://localhost:8000/sessions?cursor=${encodeURIComponent(cursor)}`, {
+            headers: { 'user-email': user.email }
+        });
+        if (!res.ok) return;
+        const page: any[] = await res.json();
+        cursorRef.current = res.headers.get('X-Next-Cursor');
+        pages += 1;
+        setSessions(prev => {
+            const ids = new Set(prev.map(s => s.id));
+            return [...prev, ...page.filter(s => !ids.has(s.id))];
+        });
+      } catch (error) {
+        console.error("Failed to load more history:", error);
+      } finally {
+        loadingMoreRef.current = false;
+      }
+    };
 
     fetchSessions();
     
-    // Poll every 5 seconds to keep history updated
+    // Poll every 5 seconds to keep history updated (first page only)
     const interval = setInterval(fetchSessions, 5000);
     return () => clearInterval(interval);
 
   }, [user]);
 
+  const handleScroll = (e: React.UIEvent<HTMLDivElement>) => {
+    const el = e.currentTarget;
+    if (el.scrollHeight - el.scrollTop - el.clientHeight < 80) loadMoreRef.current();
+  };
+
   // Inside Sidebar.tsx
 
   const handleDelete = async (e: any, id: string) => {
@@ -75,7 +116,7 @@ export function Sidebar({ isOpen, user, activeSessionId, onSessionSelect }: Side
       </div>
 
       {/* History List */}
-      <div className="flex-1 overflow-y-auto px-3 space-y-1 custom-scrollbar">
+      <div onScroll={handleScroll} className="flex-1 overflow-y-auto px-3 space-y-1 custom-scrollbar">
         <div className="px-3 py-2 text-xs font-semibold text-gray-500 uppercase tracking-wider">
           Recent History
         </div>
@@ -111,6 +152,15 @@ export function Sidebar({ isOpen, user, activeSessionId, onSessionSelect }: Side
             </button>
           </div>
         ))}
+
+        {cursorRef.current && (
+          <button
+            onClick={() => loadMoreRef.current()}
+            className="w-full py-2 text-xs text-gray-500 hover:text-gray-300 transition-all"
+          >
+            Load older
+          </button>
+        )}
       </div>
       
       {/* User Info Footer */}